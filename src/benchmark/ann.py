@@ -0,0 +1,61 @@
+'''
+
+Report on the approximate nearest neighbour index of DV.
+It builds (or loads) the DV model and its index for a project under config.SOURCE_PATH,
+whose goldsets must already be generated, and compares the index with the exhaustive ranking:
+recall of the exhaustive top k, MRR of both result lists cut at k and query time.
+
+usage: python -m src.benchmark.ann sympy python file --num-topics 500 --k 10 --tables 8
+
+'''
+import argparse
+import time
+
+from ..common.project import CommitGitProject
+from ..models.ann import recall_report
+from ..models.model import DV
+from ..models.ranking import RankingEngine
+
+
+def report(project, k=10, tables=8, bits=None, **kwargs):
+    dv = DV(project, **kwargs)
+    corpus = dv.create_corpus()
+    queries = dv.create_query()
+    model = dv.create_model(corpus)
+    index = dv.create_index(model, corpus, tables=tables, bits=bits)
+    engine = RankingEngine(*dv.get_cached_topics(model, corpus, 'code'))
+    query_ids, query_matrix = dv.get_cached_topics(model, queries, 'query')
+
+    result = recall_report(index, engine, query_ids, query_matrix, project.load_goldsets(), k)
+    start = time.perf_counter()
+    engine.top_k(query_matrix, k)
+    result['exact_seconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    index.top_k(query_matrix, k)
+    result['approximate_seconds'] = time.perf_counter() - start
+    result['bits'] = index.bits
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report recall and MRR of the DV nearest neighbour index.')
+    parser.add_argument('name')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--num-topics', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--tables', type=int, default=8)
+    parser.add_argument('--bits', type=int, default=None)
+    args = parser.parse_args()
+
+    project = CommitGitProject(name=args.name, lan=args.lan, level=args.level, goldset_num=args.goldset_num)
+    result = report(project, args.k, args.tables, args.bits, num_topics=args.num_topics, iterations=args.iterations)
+    print('{documents} documents {queries} queries, {tables} tables of {bits} bits, {candidates:.1f} candidates per query\n'
+          'recall@{k}={recall:.4f} MRR@{k} exact={exact_mrr:.4f} approximate={approximate_mrr:.4f}\n'
+          'top {k}: exact {exact_seconds:.4f}s approximate {approximate_seconds:.4f}s'.format(tables=args.tables, **result))
+
+
+if __name__ == '__main__':
+    main()
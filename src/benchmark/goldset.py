@@ -0,0 +1,72 @@
+'''
+
+Benchmark of goldset generation.
+It times CommitGoldsetGenerator.generate with every diff backend on a project under
+config.SOURCE_PATH and checks that all of them write the same goldsets.
+
+usage: python -m src.benchmark.goldset sympy python file --goldset-num 50
+
+'''
+import argparse
+import os
+import time
+
+from ..common.project import CommitGitProject
+from ..goldset.generator import CommitGoldsetGenerator
+
+
+def snapshot(project):
+    data_path = project.path_dict['data']
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(data_path):
+        for filename in filenames:
+            fname = os.path.join(dirpath, filename)
+            with open(fname) as f:
+                lines = f.read().splitlines()
+            # goldset lines come from a set and have no stable order.
+            if project.path_dict[project.level] in fname:
+                lines.sort()
+            files[os.path.relpath(fname, data_path)] = lines
+    return files
+
+
+def bench_backends(project, backends=('commit', 'log'), processes=1, repeat=1):
+    results = []
+    expected = None
+    for backend in backends:
+        generator = CommitGoldsetGenerator(project, diff_backend=backend)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            generator.generate(processes=processes)
+            timings.append(time.perf_counter() - start)
+        files = snapshot(project)
+        if expected is None:
+            expected = files
+        results.append({
+            'backend': backend,
+            'processes': processes,
+            'seconds': min(timings),
+            'goldsets': len(project.load_ids()),
+            'identical': files == expected,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark goldset generation backends.')
+    parser.add_argument('name')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    project = CommitGitProject(name=args.name, lan=args.lan, level=args.level, goldset_num=args.goldset_num)
+    for result in bench_backends(project, processes=args.processes, repeat=args.repeat):
+        print('{backend:>8} processes={processes} {seconds:.3f}s goldsets={goldsets} identical={identical}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+
+Benchmark of LDA training.
+It trains Lda on a project under config.SOURCE_PATH, whose goldsets must already be generated,
+once per number of workers (1 being the single process LdaModel) and reports the training time
+and the MRR of the ranks each model gives. Models are trained aside, the cached model is not touched.
+
+usage: python -m src.benchmark.lda sympy python file --num-topics 500 --workers 1 4
+
+'''
+import argparse
+import time
+
+from ..common import util
+from ..common.project import CommitGitProject
+from ..models.model import Lda
+
+
+def bench_workers(project, workers=(1, 4), **kwargs):
+    results = []
+    for count in workers:
+        lda = Lda(project, workers=count, **kwargs)
+        corpus = lda.create_corpus()
+        queries = lda.create_query()
+
+        start = time.perf_counter()
+        model = lda.train(corpus)
+        seconds = time.perf_counter() - start
+
+        ranks = lda.predict(lda.get_topics(model, queries), lda.get_topics(model, corpus))
+        # as read back by read_ranks, queries without ranked goldset items drop out.
+        ranks = dict((qid, rels) for qid, rels in ranks.items() if rels)
+        results.append({
+            'workers': count,
+            'seconds': seconds,
+            'mrr': util.calculate_mrr(ranks),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single and multi process LDA training.')
+    parser.add_argument('name')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--num-topics', type=int, default=500)
+    parser.add_argument('--passes', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    project = CommitGitProject(name=args.name, lan=args.lan, level=args.level, goldset_num=args.goldset_num)
+    results = bench_workers(project, args.workers, num_topics=args.num_topics,
+                            passes=args.passes, iterations=args.iterations)
+    for result in results:
+        print('workers={workers} {seconds:.3f}s mrr={mrr:.4f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
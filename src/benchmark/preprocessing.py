@@ -0,0 +1,150 @@
+'''
+
+Benchmark of the preprocessing steps on real source files.
+The character by character splitter the corpus used before is kept here as the reference
+the current preprocessing.split must match token for token.
+
+usage: python -m src.benchmark.preprocessing /path/to/sources --ext .py
+
+'''
+import argparse
+import os
+import string
+import time
+
+from ..corpus import preprocessing
+
+
+def reference_split(iterator):
+    for token in iterator:
+        word = u''
+        for char in token:
+            if char.isupper() and all(map(lambda x: x.isupper(), word)):
+                word += char
+
+            elif char.islower() and all(map(lambda x: x.isupper(), word)):
+                if len(word) > 1:
+                    yield word[:-1]
+                    word = word[-1]
+
+                word += char
+
+            elif char.islower() and any(map(lambda x: x.islower(), word)):
+                word += char
+
+            elif char.isdigit() and all(map(lambda x: x.isdigit(), word)):
+                word += char
+
+            elif char in string.punctuation:
+                if len(word) > 0:
+                    yield word
+                    word = u''
+
+                yield char
+
+            else:
+                if len(word) > 0:
+                    yield word
+
+                word = char
+
+        if len(word) > 0:
+            yield word
+
+
+def reference_remove_stops(iterator, stopwords=set(), punctuation=True, digits=True,
+                           whitespace=True):
+    if not isinstance(stopwords, set):
+        stopwords = set(stopwords)
+
+    if punctuation:
+        stopwords.update(string.punctuation)
+
+    if digits:
+        stopwords.update(string.digits)
+
+    if whitespace:
+        stopwords.update(string.whitespace)
+
+    stopwords.update([''])
+    for word in filter(lambda x: x not in stopwords, iterator):
+        try:
+            int(word)
+            float(word)
+        except ValueError:
+            yield word
+
+
+def reference_filter(words, reserved_words, min_len, max_len):
+    words = reference_remove_stops(words, preprocessing.FOX_STOPS)
+    words = reference_remove_stops(words, reserved_words)
+    return (word for word in words if len(word) >= min_len and len(word) <= max_len)
+
+
+def load_tokens(src_path, ext, limit=None):
+    tokens = []
+    files = 0
+    for dirpath, dirnames, filenames in os.walk(src_path):
+        if '.git' in dirpath:
+            continue
+        for filename in filenames:
+            if filename.endswith(ext):
+                with open(os.path.join(dirpath, filename), 'rb') as f:
+                    document = preprocessing.to_unicode(f.read())
+                tokens.extend(preprocessing.tokenize(document))
+                files += 1
+                if limit and files >= limit:
+                    return files, tokens
+    return files, tokens
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_split(tokens):
+    reference_seconds, expected = timed(lambda: list(reference_split(tokens)))
+    seconds, words = timed(lambda: list(preprocessing.split(tokens)))
+    return {
+        'step': 'split',
+        'tokens': len(tokens),
+        'reference': reference_seconds,
+        'current': seconds,
+        'identical': words == expected,
+    }
+
+
+def bench_stops(tokens, reserved_words=preprocessing.PYTHON_RESERVED, min_len=3, max_len=40):
+    words = [word.lower() for word in preprocessing.split(tokens)]
+    reference_seconds, expected = timed(lambda: list(reference_filter(words, reserved_words, min_len, max_len)))
+    stop_filter = preprocessing.StopFilter(preprocessing.FOX_STOPS, reserved_words, min_len=min_len, max_len=max_len)
+    seconds, kept = timed(lambda: list(stop_filter(words)))
+    return {
+        'step': 'remove_stops',
+        'tokens': len(words),
+        'reference': reference_seconds,
+        'current': seconds,
+        'identical': kept == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing on source files.')
+    parser.add_argument('src_path')
+    parser.add_argument('--ext', default='.py')
+    parser.add_argument('--limit', type=int, default=None, help='maximum number of files')
+    args = parser.parse_args()
+
+    files, tokens = load_tokens(args.src_path, args.ext, args.limit)
+    print('{} files, {} tokens'.format(files, len(tokens)))
+    for result in [bench_split(tokens), bench_stops(tokens)]:
+        print('{step:>12}: reference {reference:.3f}s current {current:.3f}s '
+              'speedup {speedup:.1f}x {throughput:.0f} tokens/s identical={identical}'.format(
+                  throughput=result['tokens'] / max(result['current'], 1e-9),
+                  speedup=result['reference'] / max(result['current'], 1e-9), **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+
+Profiles the stages of the pipeline on a project under config.SOURCE_PATH: goldset generation
+(with --generate) and get_ranks of a model, which creates the corpus and the queries, trains
+the model, infers the topics and ranks unless the ranks of the configuration are already stored,
+in which case they are only read.
+The report of the run, stage by stage, is written as JSON, see common.profiling,
+and --profile-stage also dumps the cProfile stats of one stage, e.g. get_ranks/predict.
+
+usage: python -m src.benchmark.stages sympy python file --model lda --generate --report sympy.json --profile-stage predict --profile-out predict.prof
+
+'''
+import argparse
+import json
+import logging
+
+from ..common import config
+from ..common.profiling import Profiler
+from ..common.project import CommitGitProject
+from ..goldset.generator import CommitGoldsetGenerator
+from ..models.model import DV, Lda, WordSum
+
+MODELS = {
+    'dv': DV,
+    'lda': Lda,
+    'wordsum': WordSum,
+}
+
+
+def profile_run(project, model_name='lda', generate=False, processes=1, profile_stage=None, profile_fname=None,
+                num_topics=500, iterations=30):
+    model = MODELS[model_name](project, num_topics=num_topics, iterations=iterations)
+    with Profiler(project.name, profile_stage, profile_fname) as profiler:
+        if generate:
+            CommitGoldsetGenerator(project).generate(processes)
+        model.get_ranks()
+    return profiler.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the stages of goldset generation and ranking.')
+    parser.add_argument('name')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--model', choices=sorted(MODELS), default='lda')
+    parser.add_argument('--num-topics', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--generate', action='store_true', help='generate the goldsets first')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--report', help='JSON report to write, the standard output by default')
+    parser.add_argument('--profile-stage', help='stage name or path to run under cProfile')
+    parser.add_argument('--profile-out', help='file the cProfile stats are dumped to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=config.LOG_LEVEL)
+    project = CommitGitProject(name=args.name, lan=args.lan, level=args.level, goldset_num=args.goldset_num)
+    profile_fname = args.profile_out
+    if args.profile_stage and not profile_fname:
+        profile_fname = '{}.{}.prof'.format(args.name, args.profile_stage.replace('/', '.'))
+    report = profile_run(project, args.model, args.generate, args.processes, args.profile_stage, profile_fname,
+                         args.num_topics, args.iterations)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+
+Micro-benchmark of resolving changed methods from diff hunks.
+It builds a synthetic module with many classes and functions and compares the nested
+scan over every node per hunk with the lookup through goldset.structure.IntervalIndex.
+
+usage: python -m src.benchmark.structure --classes 200 --methods 10 --hunks 2000
+
+'''
+import argparse
+import random
+import time
+
+from ..goldset.structure import IntervalIndex, parse_python
+
+
+def synthetic_module(classes, methods, functions):
+    lines = []
+    for c in range(classes):
+        lines.append('class Class{}(object):'.format(c))
+        for m in range(methods):
+            lines.append('    def method{}(self, value):'.format(m))
+            lines.append('        value = value + {}'.format(m))
+            lines.append('        return value')
+            lines.append('')
+    for f in range(functions):
+        lines.append('def function{}(value):'.format(f))
+        lines.append('    return value * {}'.format(f))
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def scan(structure, start_line, end_line):
+    names = []
+    for name, start, end in structure['functions']:
+        if not (start_line > end or end_line < start):
+            names.append(name)
+    for class_name, methods in structure['classes']:
+        for name, start, end in methods:
+            if not (start_line > end or end_line < start):
+                names.append('.'.join([class_name, name]))
+    return names
+
+
+def bench(classes=200, methods=10, functions=200, hunks=2000, seed=0):
+    structure = parse_python(synthetic_module(classes, methods, functions))
+    rng = random.Random(seed)
+    ranges = []
+    for _ in range(hunks):
+        start = rng.randint(1, structure['lines'])
+        ranges.append((start, start + rng.randint(0, 20)))
+
+    begin = time.perf_counter()
+    expected = [sorted(scan(structure, start, end)) for start, end in ranges]
+    scan_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    index = IntervalIndex.from_structure(structure)
+    found = [sorted(index.overlaps(start, end)) for start, end in ranges]
+    index_seconds = time.perf_counter() - begin
+
+    return {
+        'nodes': len(index.names),
+        'hunks': hunks,
+        'scan': scan_seconds,
+        'index': index_seconds,
+        'identical': found == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark changed method lookup.')
+    parser.add_argument('--classes', type=int, default=200)
+    parser.add_argument('--methods', type=int, default=10)
+    parser.add_argument('--functions', type=int, default=200)
+    parser.add_argument('--hunks', type=int, default=2000)
+    args = parser.parse_args()
+
+    result = bench(args.classes, args.methods, args.functions, args.hunks)
+    print('{nodes} methods, {hunks} hunks: scan {scan:.4f}s index {index:.4f}s '
+          'identical={identical}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+'''
+
+Benchmark suite of the whole pipeline on synthetic repositories (see benchmark.synthetic).
+For every language it generates a repository of the given size under <workdir>/sources and
+times every stage on it, each under a Profiler whose counters give its throughput:
+    goldset.<level>  CommitGoldsetGenerator.generate over the whole history   commits/s
+    <model>.corpus   create_corpus                                             files/s
+    <model>.query    create_query                                              queries/s
+    <model>.train    create_model, at a small number of topics                 docs/s
+    <model>.infer    get_topics of the queries and the code                    docs/s
+    <model>.rank     predict                                                   pairs/s
+for every level of the language and the lda and dv models at file level, named <lan>.<stage>.
+Every stage runs `repeat` times from scratch and keeps its fastest run.
+
+The results are compared against the baseline stored in <workdir>, if it was measured with the
+same parameters, and a stage whose throughput dropped by more than `tolerance` fails the run.
+The first run, or any run given --save-baseline, stores its results as the baseline.
+
+usage: python -m src.benchmark.suite /tmp/bench --lan python java --files 200 --commits 500 --repeat 3
+
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+from collections import OrderedDict
+
+from ..common import config
+from ..common import util
+from ..common.profiling import Profiler
+from ..common.project import CommitGitProject
+from ..goldset.generator import CommitGoldsetGenerator
+from ..models.model import DV, Lda
+from .synthetic import SyntheticRepo
+
+# file comes last, generating a level clears the goldsets of the others.
+LEVELS = {
+    'python': ['class', 'method', 'file'],
+    'java': ['file'],
+}
+
+
+def _measure(results, name, unit, count, func):
+    '''
+    Run `func` under a Profiler and keep its result in `results` unless a faster run is there.
+    The items processed are the `count` counter of the run, or `count` of what `func` returns.
+    '''
+    with Profiler(name) as profiler:
+        value = func()
+    stats = profiler.report()['stages']['']
+    items = count(value) if callable(count) else stats['total_counters'].get(count, 0)
+    result = OrderedDict([
+        ('items', items),
+        ('unit', unit),
+        ('seconds', stats['wall']),
+        ('cpu', stats['cpu'] + stats['children_cpu']),
+        ('peak_rss', stats['peak_rss']),
+        ('per_second', items / stats['wall'] if stats['wall'] else 0.0),
+    ])
+    if name not in results or result['seconds'] < results[name]['seconds']:
+        results[name] = result
+    return value
+
+
+def bench_goldsets(results, name, lan, commits, processes=1):
+    for level in LEVELS[lan]:
+        # as many goldsets as commits, so that the whole history is visited.
+        project = CommitGitProject(name=name, lan=lan, level=level, goldset_num=commits)
+        generator = CommitGoldsetGenerator(project)
+        stage = '.'.join([lan, 'goldset', level])
+        _measure(results, stage, 'commits', 'commits_visited', lambda: generator.generate(processes))
+        results[stage]['goldsets'] = len(project.load_ids())
+    return project
+
+
+def bench_models(results, project, lan, num_topics=20, iterations=10, passes=2):
+    models = [
+        ('lda', Lda(project, num_topics=num_topics, iterations=iterations, passes=passes)),
+        ('dv', DV(project, num_topics=num_topics, iterations=iterations)),
+    ]
+    for model_name, model in models:
+        prefix = '.'.join([lan, model_name]) + '.'
+        corpus = _measure(results, prefix + 'corpus', 'files', 'files_tokenized', model.create_corpus)
+        queries = _measure(results, prefix + 'query', 'queries', len, model.create_query)
+        trained = _measure(results, prefix + 'train', 'docs', lambda _: len(corpus),
+                           lambda: model.create_model(corpus))
+        topics = _measure(results, prefix + 'infer', 'docs', 'docs_inferred',
+                          lambda: (model.get_topics(trained, queries), model.get_topics(trained, corpus)))
+        ranks = _measure(results, prefix + 'rank', 'pairs', 'distance_pairs', lambda: model.predict(*topics))
+        # the quality of the ranks, a check that the stages still do the same work.
+        ranks = dict((qid, rels) for qid, rels in ranks.items() if rels)
+        results[prefix + 'rank']['mrr'] = float(util.calculate_mrr(ranks)) if ranks else 0.0
+
+
+def run_suite(workdir, lans=('python', 'java'), files=100, commits=200, seed=0, num_topics=20, iterations=10,
+              passes=2, processes=1, repeat=1):
+    '''
+    Return {stage: result} of every stage of every language, see _measure.
+    The work is done under `workdir`, which config.SOURCE_PATH and config.BASE_PATH are pointed to.
+    '''
+    config.SOURCE_PATH = os.path.join(workdir, 'sources')
+    results = OrderedDict()
+    for lan in lans:
+        name = 'synthetic-{}-{}-{}-{}'.format(lan, files, commits, seed)
+        SyntheticRepo(lan, files, commits, seed=seed).write(os.path.join(config.SOURCE_PATH, name))
+        for _ in range(repeat):
+            # every run starts without any goldset, corpus or model.
+            config.BASE_PATH = os.path.join(workdir, 'run')
+            if os.path.exists(config.BASE_PATH):
+                shutil.rmtree(config.BASE_PATH)
+            project = bench_goldsets(results, name, lan, commits, processes)
+            bench_models(results, project, lan, num_topics, iterations, passes)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+    Return [(stage, baseline throughput, throughput, ratio, regressed), ...] for the stages in both,
+    a stage having regressed when its throughput fell below (1 - tolerance) of the baseline.
+    '''
+    rows = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]['per_second']
+        ratio = result['per_second'] / before if before else float('inf')
+        rows.append((stage, before, result['per_second'], ratio, ratio < 1.0 - tolerance))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every stage on synthetic repositories.')
+    parser.add_argument('workdir', help='where repositories, runs and the baseline are kept')
+    parser.add_argument('--lan', choices=sorted(LEVELS), nargs='+', default=['python', 'java'])
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--commits', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num-topics', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--passes', type=int, default=2)
+    parser.add_argument('--processes', type=int, default=1, help='processes of goldset generation')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='throughput drop failing a stage')
+    parser.add_argument('--baseline', help='baseline JSON, <workdir>/' + config.BENCH_BASELINE + ' by default')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--output', help='JSON to write the results to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=config.LOG_LEVEL)
+    workdir = os.path.abspath(args.workdir)
+    params = OrderedDict((key, getattr(args, key)) for key in
+                         ['lan', 'files', 'commits', 'seed', 'num_topics', 'iterations', 'passes', 'processes'])
+    results = run_suite(workdir, args.lan, args.files, args.commits, args.seed, args.num_topics,
+                        args.iterations, args.passes, args.processes, args.repeat)
+    report = OrderedDict([
+        ('params', params),
+        ('python', platform.python_version()),
+        ('machine', platform.platform()),
+        ('cpus', os.cpu_count()),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline_fname = args.baseline or os.path.join(workdir, config.BENCH_BASELINE)
+    baseline = None
+    if os.path.exists(baseline_fname):
+        with open(baseline_fname) as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print('The baseline {} was measured with {}, not compared.'.format(baseline_fname, baseline['params']))
+            baseline = None
+
+    rows = dict((row[0], row) for row in compare(results, baseline['results'], args.tolerance)) if baseline else {}
+    for stage, result in results.items():
+        line = '{:24} {:10d} {:8} {:9.3f}s {:14.1f}/s'.format(stage, result['items'], result['unit'],
+                                                            result['seconds'], result['per_second'])
+        if 'goldsets' in result:
+            line += ' goldsets={}'.format(result['goldsets'])
+        if 'mrr' in result:
+            line += ' mrr={:.4f}'.format(result['mrr'])
+        if stage in rows:
+            _, before, _, ratio, regressed = rows[stage]
+            line += ' {:6.2f}x of {:.1f}/s{}'.format(ratio, before, ' REGRESSED' if regressed else '')
+        print(line)
+
+    if args.save_baseline or not os.path.exists(baseline_fname):
+        with open(baseline_fname, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Stored the baseline in {}'.format(baseline_fname))
+    if any(row[4] for row in rows.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+'''
+
+Generates synthetic git repositories to benchmark the pipeline on, of any size and reproducible:
+the same options always give the same history, commit hashes included.
+
+Files are Python modules of classes and functions, or Java files of one class, whose identifiers
+and comments are made of the words of a topic, so that the commit messages, made of the words
+of the code they change, find it again. The first commit adds `files` files, every later one
+either adds a file or modifies a few methods of files of one topic, sometimes adding a method,
+so that goldsets exist at every level. The history is written with a single `git fast-import`
+and master is checked out.
+
+usage: python -m src.benchmark.synthetic /tmp/sources/synth python --files 200 --commits 500 --seed 0
+
+'''
+import argparse
+import keyword
+import logging
+import os
+import random
+import shutil
+import subprocess
+
+from git import Repo
+
+logger = logging.getLogger('benchmark.synthetic')
+
+CONSONANTS = 'bdfgklmnprstvz'
+VOWELS = 'aeiou'
+JAVA_KEYWORDS = {'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'const',
+                 'continue', 'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float',
+                 'for', 'goto', 'if', 'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'native',
+                 'new', 'package', 'private', 'protected', 'public', 'return', 'short', 'static', 'strictfp',
+                 'super', 'switch', 'synchronized', 'this', 'throw', 'throws', 'transient', 'try', 'void',
+                 'volatile', 'while', 'true', 'false', 'null'}
+# 2001-09-09, every commit a minute after the previous one.
+EPOCH = 1000000000
+AUTHOR = 'bench <bench@example.com>'
+
+
+class Method():
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
+
+
+class Source():
+
+    def __init__(self, path, topic, name, classes, functions):
+        self.path = path
+        self.topic = topic
+        self.name = name
+        # [(class name, [Method, ...]), ...] and module level [Method, ...], Python only.
+        self.classes = classes
+        self.functions = functions
+
+    def methods(self):
+        return [method for _, methods in self.classes for method in methods] + self.functions
+
+
+class SyntheticRepo():
+
+    def __init__(self, lan='python', files=100, commits=200, topics=10, words=400, methods=4,
+                 changes=3, add_rate=0.1, seed=0):
+        self.lan = lan.lower()
+        if self.lan not in ['python', 'java']:
+            raise NotImplementedError('Only support python or java repositories.')
+        self.files = files
+        self.commits = commits
+        self.methods = methods
+        # files changed by a commit at most.
+        self.changes = changes
+        self.add_rate = add_rate
+        self.random = random.Random(seed)
+        vocabulary = self._vocabulary(words)
+        self.topics = [vocabulary[idx::topics] for idx in range(topics)]
+        self.sources = []
+        self.paths = set()
+
+    def _vocabulary(self, size):
+        reserved = set(keyword.kwlist) | JAVA_KEYWORDS
+        words = []
+        seen = set()
+        while len(words) < size:
+            word = ''.join(self.random.choice(CONSONANTS) + self.random.choice(VOWELS)
+                           for _ in range(self.random.randint(2, 3)))
+            if word not in seen and word not in reserved:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def _words(self, topic, n):
+        # mostly words of the topic, now and then any word.
+        return [self.random.choice(self.topics[topic] if self.random.random() < 0.9
+                                   else self.random.choice(self.topics)) for _ in range(n)]
+
+    def _identifier(self, topic, n=2, title=False):
+        words = self._words(topic, n)
+        if self.lan == 'java' or title:
+            name = ''.join(word.title() for word in words)
+            return name if title else name[0].lower() + name[1:]
+        return '_'.join(words)
+
+    def _statement(self, topic, names):
+        target = self._identifier(topic)
+        names.append(target)
+        operands = self.random.sample(names[:-1], 2) if len(names) > 2 else [names[0], names[0]]
+        comment = ' '.join(self._words(topic, 3))
+        if self.lan == 'java':
+            return 'int {} = {} + {}; // {}'.format(target, operands[0], operands[1], comment)
+        return '{} = {} + {}  # {}'.format(target, operands[0], operands[1], comment)
+
+    def _method(self, topic):
+        params = [self._identifier(topic, 1) for _ in range(2)]
+        names = list(params)
+        body = [self._statement(topic, names) for _ in range(self.random.randint(2, 6))]
+        return Method(self._identifier(topic), params, body)
+
+    def _source(self):
+        topic = self.random.randrange(len(self.topics))
+        while True:
+            package = self._words(topic, self.random.randint(1, 2))
+            name = self._identifier(topic, title=self.lan == 'java')
+            if self.lan == 'java':
+                path = '/'.join(['src', 'main', 'java'] + package + [name + '.java'])
+            else:
+                path = '/'.join(package + [name + '.py'])
+            if path not in self.paths:
+                self.paths.add(path)
+                break
+        if self.lan == 'java':
+            classes = [(name, [self._method(topic) for _ in range(self.random.randint(1, self.methods))])]
+            functions = []
+        else:
+            classes = [(self._identifier(topic, title=True),
+                        [self._method(topic) for _ in range(self.random.randint(1, self.methods))])
+                       for _ in range(self.random.randint(0, 2))]
+            functions = [self._method(topic) for _ in range(self.random.randint(0 if classes else 1, 2))]
+        return Source(path, topic, name, classes, functions)
+
+    def render(self, source):
+        doc = ' '.join(self._doc_words(source))
+        if self.lan == 'java':
+            package = '.'.join(source.path.split('/')[3:-1])
+            lines = ['package {};'.format(package), '', '/**', ' * {}'.format(doc), ' */']
+            for class_name, methods in source.classes:
+                lines.append('public class {} {{'.format(class_name))
+                for method in methods:
+                    lines.append('')
+                    lines.append('    public int {}({}) {{'.format(
+                        method.name, ', '.join('int ' + param for param in method.params)))
+                    lines.extend('        ' + statement for statement in method.body)
+                    lines.append('        return {};'.format(method.params[0]))
+                    lines.append('    }')
+                lines.append('}')
+            return '\n'.join(lines) + '\n'
+
+        lines = ["'''", '', doc, '', "'''"]
+
+        def render_method(method, indent, params):
+            lines.extend(['', ''] if not indent else [''])
+            lines.append('{}def {}({}):'.format(indent, method.name, ', '.join(params + method.params)))
+            lines.extend(indent + '    ' + statement for statement in method.body)
+            lines.append('{}    return {}'.format(indent, method.params[0]))
+
+        for method in source.functions:
+            render_method(method, '', [])
+        for class_name, methods in source.classes:
+            lines.extend(['', '', 'class {}():'.format(class_name)])
+            for method in methods:
+                render_method(method, '    ', ['self'])
+        return '\n'.join(lines) + '\n'
+
+    def _doc_words(self, source):
+        # stable per file, a docstring is not what commits change.
+        state = random.Random(source.path)
+        return [state.choice(self.topics[source.topic]) for _ in range(8)]
+
+    def _change(self):
+        # (message, changed sources) of a commit modifying files of one topic.
+        topic = self.random.randrange(len(self.topics))
+        candidates = [source for source in self.sources if source.topic == topic] or self.sources
+        changed = self.random.sample(candidates, min(len(candidates), self.random.randint(1, self.changes)))
+        words = []
+        for source in changed:
+            if source.classes and self.random.random() < 0.1:
+                _, methods = self.random.choice(source.classes)
+                method = self._method(source.topic)
+                methods.append(method)
+                words.extend(['add'] + method.name.split('_'))
+                continue
+            method = self.random.choice(source.methods())
+            names = method.params + [statement.split()[1 if self.lan == 'java' else 0] for statement in method.body]
+            statement = self._statement(source.topic, names)
+            if method.body and self.random.random() < 0.5:
+                method.body[self.random.randrange(len(method.body))] = statement
+            else:
+                method.body.insert(self.random.randint(0, len(method.body)), statement)
+            words.extend(self._split(method.name))
+        words.extend(self._words(topic, 4))
+        return 'Fix {}\n'.format(' '.join(words)), changed
+
+    def _split(self, name):
+        if self.lan == 'java':
+            return [part.lower() for part in self._camel_parts(name)]
+        return name.split('_')
+
+    @staticmethod
+    def _camel_parts(name):
+        parts = ['']
+        for char in name:
+            if char.isupper() and parts[-1]:
+                parts.append('')
+            parts[-1] += char
+        return parts
+
+    def history(self):
+        '''
+        Yield (message, [(path, content), ...]) per commit, oldest first.
+        '''
+        for _ in range(self.files):
+            self.sources.append(self._source())
+        yield 'Add {} files\n'.format(len(self.sources)), [(source.path, self.render(source))
+                                                            for source in self.sources]
+        for _ in range(self.commits - 1):
+            if self.random.random() < self.add_rate:
+                source = self._source()
+                self.sources.append(source)
+                message = 'Add {}\n'.format(' '.join(self._split(source.name) + self._words(source.topic, 4)))
+                changed = [source]
+            else:
+                message, changed = self._change()
+            yield message, [(source.path, self.render(source)) for source in changed]
+
+    def write(self, dirname):
+        '''
+        Write the repository to `dirname`, replacing whatever is there, and return its Repo.
+        '''
+        if os.path.exists(dirname):
+            shutil.rmtree(dirname)
+        repo = Repo.init(dirname)
+        repo.git.symbolic_ref('HEAD', 'refs/heads/master')
+        process = repo.git.fast_import('--quiet', as_process=True, istream=subprocess.PIPE)
+        stream = process.proc.stdin
+        for idx, (message, files) in enumerate(self.history()):
+            stamp = '{} +0000'.format(EPOCH + idx * 60)
+            message = message.encode('utf-8')
+            stream.write('commit refs/heads/master\nauthor {0} {1}\ncommitter {0} {1}\ndata {2}\n'.format(
+                AUTHOR, stamp, len(message)).encode('utf-8'))
+            stream.write(message + b'\n')
+            for path, content in files:
+                content = content.encode('utf-8')
+                stream.write('M 100644 inline {}\ndata {}\n'.format(path, len(content)).encode('utf-8'))
+                stream.write(content + b'\n')
+        stream.close()
+        process.wait()
+        repo.git.checkout('-f', '-q', 'master')
+        logger.info('Wrote %d commits of %d files to %s', self.commits, len(self.sources), dirname)
+        return repo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic git repository.')
+    parser.add_argument('dirname')
+    parser.add_argument('lan', choices=['python', 'java'])
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--commits', type=int, default=200)
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    repo = SyntheticRepo(args.lan, args.files, args.commits, args.topics, seed=args.seed).write(args.dirname)
+    print(repo.head.commit.hexsha)
+
+
+if __name__ == '__main__':
+    main()
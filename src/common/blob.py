@@ -0,0 +1,103 @@
+'''
+
+This module caches the content of git blobs and the diffs between them.
+Blobs are read through the persistent `git cat-file --batch` process GitPython keeps per repository,
+and kept in a size bounded LRU cache keyed by blob sha so that the same content is only fetched once.
+
+'''
+import logging
+from collections import OrderedDict
+
+from . import config
+
+logger = logging.getLogger('cfl.blob')
+
+
+class BlobCache():
+
+    def __init__(self, project, max_size=config.BLOB_CACHE_SIZE):
+        self.project = project
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        # blobs are keyed by ('blob', sha) and diffs by ('diff', a_sha, b_sha)
+        # so that both share one LRU order and size bound.
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.diff_hits = 0
+        self.diff_misses = 0
+        self.diff_prefetched = 0
+
+    def read(self, hexsha):
+        '''
+        Return the content of a blob as `git show` gives it through GitPython,
+        i.e. decoded and without its trailing newline.
+        '''
+        key = ('blob', str(hexsha))
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        _, _, _, data = self.project.repo.git.get_object_data(key[1])
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        content = data.decode('utf-8', 'surrogateescape')
+        self._put(key, content)
+        return content
+
+    def diff(self, a_blob, b_blob):
+        key = ('diff', str(a_blob), str(b_blob))
+        if key in self.entries:
+            self.diff_hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.diff_misses += 1
+        diff_info = self.project.repo.git.diff(key[1], key[2])
+        self._put(key, diff_info)
+        return diff_info
+
+    def prefetch_diffs(self, prev_commit, commit, diffs):
+        '''
+        Fill the diff cache for the given modified diffs with one `git diff-tree` call for the whole commit,
+        instead of one `git diff` call per file.
+        '''
+        diffs = [diff for diff in diffs if ('diff', str(diff.a_blob), str(diff.b_blob)) not in self.entries]
+        if not diffs:
+            return
+
+        paths = sorted(set(p for diff in diffs for p in (diff.a_path, diff.b_path)))
+        output = self.project.repo.git.diff_tree('-p', '-M', '--full-index', '--no-color', '--no-ext-diff',
+                                                 str(prev_commit), str(commit), '--', *paths)
+        wanted = set(('diff', str(diff.a_blob), str(diff.b_blob)) for diff in diffs)
+        self.diff_prefetched += len(wanted)
+        for section in ('\n' + output).split('\ndiff --git ')[1:]:
+            # the index line follows at most the mode and rename lines.
+            for line in section.split('\n', 7)[:7]:
+                if line.startswith('index '):
+                    key = ('diff',) + tuple(line.split()[1].split('..'))
+                    if key in wanted:
+                        self._put(key, 'diff --git ' + section)
+                    break
+
+    def _put(self, key, value):
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_size and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'diff_hits': self.diff_hits,
+            'diff_misses': self.diff_misses,
+            'diff_prefetched': self.diff_prefetched,
+            'size': self.size,
+        }
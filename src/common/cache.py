@@ -0,0 +1,248 @@
+'''
+
+This module keeps the artifacts of the pipeline (goldsets, corpora and dictionaries, models, topic matrices)
+in a content-addressed cache, so that an artifact is reused exactly when everything it is made from is the same.
+
+An entry is a directory named by the key of its stage, a hash of the parameters of the stage and of the keys
+of the entries it is made from, e.g. a model is keyed by its training parameters and the key of its corpus,
+which in turn is keyed by the tree it was read from and the preprocessing options.
+Changing any of them gives new keys down the pipeline, while equivalent artifacts share one entry.
+
+The entries are listed in index.json with their stage and size. An entry only counts once
+it is stored, a directory left by an interrupted stage is rebuilt. Whenever the entries outgrow
+the size bound the least recently used ones are evicted.
+A process using an entry pins it with a shared lock on <key>.lock until it releases its cache,
+and eviction passes over pinned entries, so that no entry is removed while another task reads it.
+Pinning also sets the modification time of <key>.lock, the last use of the entry, so that looking
+entries up only reads the index and tasks do not wait on each other for it.
+
+usage: python -m src.common.cache <cache dir> --max-size 20G --dry-run
+
+'''
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from . import config
+
+logger = logging.getLogger('cfl.cache')
+
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def stage_key(stage, **inputs):
+    '''
+    Return the key of a `stage` made from `inputs`, any JSON serializable values
+    such as parameters and the keys of other stages.
+    '''
+    inputs['stage'] = stage
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def parse_size(size):
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def dir_size(dirname):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(dirname):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+class ArtifactCache():
+
+    def __init__(self, root, max_size=config.CACHE_SIZE):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+        self.index_fname = os.path.join(root, config.CACHE_INDEX)
+        # key -> open lock file of every entry this process uses.
+        self.pins = {}
+
+    def __getstate__(self):
+        # locks belong to the process which took them.
+        state = self.__dict__.copy()
+        state['pins'] = {}
+        return state
+
+    def __del__(self):
+        self.release()
+
+    def _lock_fname(self, key):
+        return os.path.join(self.root, key[:2], key + '.lock')
+
+    def pin(self, key):
+        '''
+        Keep the entry of `key` from being evicted until release.
+        '''
+        while key not in self.pins:
+            os.makedirs(os.path.join(self.root, key[:2]), exist_ok=True)
+            lock = open(self._lock_fname(key), 'a')
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            # an eviction may have removed the file while this process waited for it.
+            if os.path.exists(lock.name) and os.path.samestat(os.fstat(lock.fileno()), os.stat(lock.name)):
+                self.pins[key] = lock
+            else:
+                lock.close()
+        os.utime(self.pins[key].fileno())
+
+    def release(self):
+        for lock in getattr(self, 'pins', {}).values():
+            lock.close()
+        self.pins = {}
+
+    def path(self, key):
+        # the directory of an entry, created so that a stage can write into it.
+        self.pin(key)
+        dirname = os.path.join(self.root, key[:2], key)
+        os.makedirs(dirname, exist_ok=True)
+        return dirname
+
+    @contextmanager
+    def _index(self, write=False):
+        # the index, read and written back under a lock shared by every process.
+        with open(os.path.join(self.root, config.CACHE_INDEX + '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                entries = {}
+                if os.path.exists(self.index_fname):
+                    with open(self.index_fname) as f:
+                        entries = json.load(f)
+                yield entries
+                if write:
+                    with open(self.index_fname + '.tmp', 'w') as f:
+                        json.dump(entries, f, indent=1, sort_keys=True)
+                    os.replace(self.index_fname + '.tmp', self.index_fname)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def entries(self):
+        with self._index() as entries:
+            return entries
+
+    def contains(self, key, touch=True):
+        '''
+        Return whether the entry of `key` is stored, marking it as used and pinning it unless `touch` is False.
+        '''
+        with self._index() as entries:
+            if key not in entries:
+                return False
+            if touch:
+                # under the index lock, so that the entry cannot be evicted in between.
+                self.pin(key)
+            return True
+
+    def store(self, key, stage, **meta):
+        '''
+        Record the directory of `key` as the complete entry of `stage`, `meta` describing it
+        in reports, and evict entries until the cache fits its size bound again.
+        Storing a stored entry again updates its size.
+        '''
+        size = dir_size(self.path(key))
+        now = time.time()
+        with self._index(write=True) as entries:
+            entry = entries.setdefault(key, {'stage': stage, 'created': now, 'meta': meta})
+            entry['size'] = size
+            entry['used'] = now
+            evicted = self._evict(entries, keep=key)
+        logger.info('Stored %s %s (%d bytes), evicted %d entries', stage, key, size, len(evicted))
+        return evicted
+
+    def _used(self, key, entry):
+        # the last time the entry was pinned, or stored if its lock is gone.
+        try:
+            return os.path.getmtime(self._lock_fname(key))
+        except OSError:
+            return entry['used']
+
+    def _lru(self, entries, keep=None):
+        # (key, lock) of the entries beyond the size bound, least recently used first,
+        # each locked for eviction, passing over the pinned ones.
+        total = sum(entry['size'] for entry in entries.values())
+        victims = []
+        for key in sorted(entries, key=lambda key: self._used(key, entries[key])):
+            if total <= self.max_size:
+                break
+            if key == keep or key in self.pins:
+                continue
+            lock = self._lock_victim(key)
+            if lock is None:
+                logger.info('Not evicting %s %s, it is in use', entries[key]['stage'], key)
+                continue
+            victims.append((key, lock))
+            total -= entries[key]['size']
+        return victims
+
+    def _lock_victim(self, key):
+        # the lock of an entry no other process pins, None if one does.
+        lock = open(self._lock_fname(key), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def _evict(self, entries, keep=None):
+        victims = []
+        for key, lock in self._lru(entries, keep):
+            with lock:
+                del entries[key]
+                shutil.rmtree(os.path.join(self.root, key[:2], key), ignore_errors=True)
+                os.remove(self._lock_fname(key))
+            victims.append(key)
+        return victims
+
+    def evict(self, dry_run=False):
+        '''
+        Return the keys of the entries evicted to fit the size bound, or those that would be.
+        Pinned entries are not evicted.
+        '''
+        with self._index(write=not dry_run) as entries:
+            if dry_run:
+                victims = self._lru(entries)
+                for _, lock in victims:
+                    lock.close()
+                return [key for key, _ in victims]
+            return self._evict(entries)
+
+    def report(self):
+        '''
+        Return the number of entries and bytes per stage.
+        '''
+        stages = {}
+        for entry in self.entries().values():
+            count, size = stages.get(entry['stage'], (0, 0))
+            stages[entry['stage']] = (count + 1, size + entry['size'])
+        return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report on and evict entries of an artifact cache.')
+    parser.add_argument('root')
+    parser.add_argument('--max-size', default=str(config.CACHE_SIZE), help='e.g. 500M or 20G')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be evicted')
+    args = parser.parse_args()
+
+    cache = ArtifactCache(args.root, parse_size(args.max_size))
+    for stage, (count, size) in sorted(cache.report().items()):
+        print('{:10} {:6d} entries {:14d} bytes'.format(stage, count, size))
+    entries = cache.entries()
+    for key in cache.evict(dry_run=args.dry_run):
+        print('{} {} {} {}'.format('would evict' if args.dry_run else 'evicted', entries[key]['stage'], key,
+                                   json.dumps(entries[key]['meta'], sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main()
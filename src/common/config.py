@@ -9,8 +9,21 @@ BASE_PATH = '/Users/chenhongxin/Code/feature-location'
 SOURCE_PATH = '/Users/chenhongxin/Code/feature-location/sources'
 ID2WORD_EXT = 'id2word.gz'
 CORPUS_EXT = 'corpus.gz'
+BINARY_CORPUS_EXT = 'corpus.bin'
 PROJECT_EXT = 'project.txt'
 MODEL_EXT = 'model.gz'
+TOPICS_EXT = 'topics.npy'
+ANN_EXT = 'ann.npz'
+WORDSUM_TIE_EPS = 1e-5
+INFER_CACHE = 'infer.cache.npz'
 RANK_EXT = 'rank.csv'
+RANK_STORE = 'rank.store'
 MRR_EXT = 'mrr.csv'
+BLOB_CACHE_SIZE = 256 * 1024 * 1024
+PARSE_CACHE = 'parse.cache.jsonl'
+MANIFEST_EXT = 'manifest.json'
+CACHE_SIZE = 20 * 1024 * 1024 * 1024
+CACHE_INDEX = 'index.json'
+CACHE_KEY = 'cache.key'
+BENCH_BASELINE = 'benchmark.baseline.json'
 
@@ -0,0 +1,264 @@
+'''
+
+This module evaluates rankings beyond the MRR of util.calculate_mrr, straight from the rank stores
+GeneralModel.write_ranks keeps per project, or the rank CSVs it used to leave next to every model,
+without touching the models.
+
+Both list, per query, the rank of each of its goldset items found in the corpus.
+The ranks of any number of projects and configurations are loaded into one RankTable of flat arrays,
+and the metrics of every query of every run are computed together:
+    MRR       1 / rank of the first goldset item
+    MAP       mean over the goldset items of (items ranked up to it) / its rank
+    P@k, R@k  goldset items in the top k over k, and over the goldset items ranked
+    Top-k     whether a goldset item is in the top k
+Recall and MAP count the goldset items found in the corpus, as the ranks hold no others,
+and queries without any of them drop out as they do in read_ranks.
+Each run mean comes with a percentile bootstrap confidence interval over its queries.
+A model with a cache stores ranks by the key of their stage too, so that a store may hold several runs
+of one configuration, over different trees or goldsets, told apart by the start of that key. Only the
+last of them count with RankStore.compact(ignore=['key']), which drops the others from the store.
+
+usage: python -m src.common.metrics <rank store, csv or directory> ... --k 1 5 10 --bootstrap 1000
+
+'''
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import sys
+
+import numpy
+
+from . import config
+from .rankstore import RankStore
+
+logger = logging.getLogger('cfl.metrics')
+
+# .../<project>/goldset_num_<n>/<Model>/num_topics_<t>_iter_<i>/<Model>.<level>.rank.csv
+RUN_PATTERN = re.compile(r'(?P<project>[^/]+)/goldset_num_(?P<goldset_num>\d+)/(?P<model>[^/]+)/'
+                         r'num_topics_(?P<num_topics>\d+)_iter_(?P<iterations>\d+)/'
+                         r'[^/]+\.(?P<level>[^/.]+)\.' + re.escape(config.RANK_EXT) + '$')
+GOLDSET_NUM_PATTERN = re.compile(r'^goldset_num_(?P<goldset_num>\d+)$')
+# hex digits of the stage key telling runs of a configuration apart.
+KEY_PREFIX = 12
+
+
+def describe_run(fname):
+    '''
+    Return the project, goldset size, model, configuration and level of a rank CSV
+    as read from its path, or only its path if it is not laid out by GeneralModel.
+    '''
+    match = RUN_PATTERN.search(os.path.abspath(fname))
+    run = match.groupdict() if match else {}
+    run['path'] = fname
+    return run
+
+
+def describe_config(fname, rank_config):
+    # the same description of a configuration kept in a rank store.
+    run = {'project': os.path.basename(os.path.dirname(os.path.abspath(fname)))}
+    match = GOLDSET_NUM_PATTERN.match(rank_config['base'])
+    if match:
+        run['goldset_num'] = match.group('goldset_num')
+    else:
+        run['base'] = rank_config['base']
+    for field in ('model', 'num_topics', 'iterations', 'level'):
+        run[field] = str(rank_config[field])
+    if 'key' in rank_config:
+        run['key'] = rank_config['key'][:KEY_PREFIX]
+    run['path'] = fname
+    return run
+
+
+def find_rank_files(paths):
+    fnames = []
+    for p in paths:
+        if os.path.isdir(p):
+            fnames.extend(sorted(glob.glob(os.path.join(p, '**', config.RANK_STORE), recursive=True)))
+            fnames.extend(sorted(glob.glob(os.path.join(p, '**', '*.' + config.RANK_EXT), recursive=True)))
+        else:
+            fnames.append(p)
+    return fnames
+
+
+class RankTable():
+    '''
+    The ranked goldset items of many runs, one entry per stored rank:
+    `run` and `query` index `runs` and `query_ids`, `query_run` gives the run of every query.
+    '''
+
+    def __init__(self, runs, query_ids, query_run, query, rank):
+        self.runs = runs
+        self.query_ids = numpy.asarray(query_ids, dtype=str)
+        self.query_run = numpy.asarray(query_run, dtype=numpy.int64)
+        self.query = numpy.asarray(query, dtype=numpy.int64)
+        self.rank = numpy.asarray(rank, dtype=numpy.int64)
+
+    @classmethod
+    def from_ranks(cls, runs):
+        '''
+        Build the table from (run, ranks) pairs, ranks being {qid: [(rank, distance, item), ...]}
+        as read_ranks returns them.
+        '''
+        descriptions, query_ids, query_run, query, rank = [], [], [], [], []
+        for run_idx, (run, ranks) in enumerate(runs):
+            descriptions.append(run)
+            for qid, rels in ranks.items():
+                if not rels:
+                    continue
+                query.extend([len(query_ids)] * len(rels))
+                rank.extend(idx for idx, _, _ in rels)
+                query_ids.append(qid)
+                query_run.append(run_idx)
+        return cls(descriptions, query_ids, query_run, query, rank)
+
+    @classmethod
+    def load(cls, fnames):
+        '''
+        Load rank stores and rank CSVs, a CSV is skipped if a store
+        already holds the ranks of its configuration.
+        '''
+        runs, query_ids, query_run, query, rank = [], [], [], [], []
+        stored = set()
+        for fname in fnames:
+            if os.path.basename(fname) != config.RANK_STORE:
+                continue
+            configs, columns = RankStore(fname).load_all()
+            # a query of one configuration is not that of another.
+            n_strings = max(len(columns['strings']), 1)
+            keys = columns['config'].astype(numpy.int64) * n_strings + columns['query']
+            unique, inverse = numpy.unique(keys, return_inverse=True)
+            query.append(inverse.ravel() + len(query_ids))
+            rank.append(columns['rank'])
+            query_ids.extend(columns['strings'][unique % n_strings].tolist())
+            query_run.extend((unique // n_strings + len(runs)).tolist())
+            for rank_config in configs:
+                run = describe_config(fname, rank_config)
+                # a CSV has no key, any stored run of its configuration supersedes it.
+                stored.add(tuple(sorted((k, v) for k, v in run.items() if k not in ['path', 'key'])))
+                runs.append(run)
+
+        for fname in fnames:
+            if os.path.basename(fname) == config.RANK_STORE:
+                continue
+            run = describe_run(fname)
+            if tuple(sorted((k, v) for k, v in run.items() if k != 'path')) in stored:
+                logger.info('Skipping %s, its ranks are stored', fname)
+                continue
+            queries = {}
+            file_query, file_rank = [], []
+            with open(fname) as f:
+                reader = csv.reader(f)
+                next(reader)
+                for qid, idx, _, _ in reader:
+                    if qid not in queries:
+                        queries[qid] = len(query_ids)
+                        query_ids.append(qid)
+                        query_run.append(len(runs))
+                    file_query.append(queries[qid])
+                    file_rank.append(idx)
+            query.append(numpy.array(file_query, dtype=numpy.int64))
+            rank.append(numpy.array(file_rank, dtype=numpy.int64))
+            runs.append(run)
+        query = numpy.concatenate(query) if query else numpy.zeros(0, dtype=numpy.int64)
+        rank = numpy.concatenate(rank).astype(numpy.int64) if rank else numpy.zeros(0, dtype=numpy.int64)
+        logger.info('Loaded %d ranked items of %d queries in %d runs', len(rank), len(query_ids), len(runs))
+        return cls(runs, query_ids, query_run, query, rank)
+
+    def query_metrics(self, ks=(1, 5, 10)):
+        '''
+        Return (queries, {metric: values}) with the index of every query having
+        a ranked goldset item and the values of every metric for them.
+        '''
+        order = numpy.lexsort((self.rank, self.query))
+        query = self.query[order]
+        rank = self.rank[order].astype(numpy.float64)
+        starts = numpy.flatnonzero(numpy.concatenate(([True], query[1:] != query[:-1]))) \
+            if len(query) else numpy.array([], dtype=numpy.int64)
+        counts = numpy.diff(numpy.append(starts, len(query)))
+        # position of every item among the goldset items of its query.
+        position = numpy.arange(len(query)) - numpy.repeat(starts, counts) + 1
+
+        def per_query(values):
+            return numpy.add.reduceat(values, starts) if len(starts) else numpy.zeros(0)
+
+        first = rank[starts]
+        metrics = {
+            'mrr': 1.0 / first,
+            'map': per_query(position / rank) / counts,
+        }
+        for k in ks:
+            hits = per_query((rank <= k).astype(numpy.float64))
+            metrics['p@{}'.format(k)] = hits / k
+            metrics['r@{}'.format(k)] = hits / counts
+            metrics['top{}'.format(k)] = (first <= k).astype(numpy.float64)
+        return query[starts], metrics
+
+    def summarize(self, ks=(1, 5, 10), bootstrap=1000, confidence=0.95, seed=0):
+        '''
+        Return a row per run with its number of queries, the mean of every metric and,
+        unless `bootstrap` is 0, the bounds <metric>_low and <metric>_high of its
+        `confidence` interval from that many resamples of the queries.
+        '''
+        queries, metrics = self.query_metrics(ks)
+        names = list(metrics)
+        values = numpy.column_stack([metrics[name] for name in names]) if len(queries) \
+            else numpy.zeros((0, len(names)))
+        query_run = self.query_run[queries]
+        order = numpy.argsort(query_run, kind='stable')
+        query_run, values = query_run[order], values[order]
+        bounds = numpy.searchsorted(query_run, numpy.arange(len(self.runs) + 1))
+
+        random = numpy.random.RandomState(seed)
+        tail = (1.0 - confidence) / 2 * 100
+        rows = []
+        for run_idx, run in enumerate(self.runs):
+            run_values = values[bounds[run_idx]:bounds[run_idx + 1]]
+            row = dict(run)
+            row['queries'] = len(run_values)
+            means = run_values.mean(axis=0) if len(run_values) else numpy.full(len(names), numpy.nan)
+            if bootstrap and len(run_values):
+                samples = random.randint(0, len(run_values), (bootstrap, len(run_values)))
+                resampled = run_values[samples].mean(axis=1)
+                low, high = numpy.percentile(resampled, [tail, 100 - tail], axis=0)
+            for idx, name in enumerate(names):
+                row[name] = float(means[idx])
+                if bootstrap:
+                    row[name + '_low'] = float(low[idx]) if len(run_values) else numpy.nan
+                    row[name + '_high'] = float(high[idx]) if len(run_values) else numpy.nan
+            rows.append(row)
+        return rows
+
+
+def write_summary(rows, f):
+    fields = []
+    for row in rows:
+        fields.extend(field for field in row if field not in fields)
+    writer = csv.DictWriter(f, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute ranking metrics with confidence intervals from rank CSVs.')
+    parser.add_argument('paths', nargs='+', help='rank CSVs or directories searched for them')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--bootstrap', type=int, default=1000, help='resamples, 0 for none')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='CSV to write, the standard output by default')
+    args = parser.parse_args()
+
+    table = RankTable.load(find_rank_files(args.paths))
+    rows = table.summarize(args.k, args.bootstrap, args.confidence, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_summary(rows, f)
+    else:
+        write_summary(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
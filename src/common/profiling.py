@@ -0,0 +1,198 @@
+'''
+
+This module measures where the time of a run goes, stage by stage.
+The pipeline marks its stages and counts what it processes through the module functions
+
+    with profiling.stage('create_corpus'):
+        ...
+        profiling.count('files_tokenized')
+
+which do nothing unless a Profiler is active. For every stage, named by its path in the stages
+around it (e.g. get_ranks/predict), the active Profiler sums the number of calls, wall time,
+CPU time of the process and of the subprocesses it waited for, and the counts made in it,
+and keeps its peak RSS. Every git command GitPython runs is counted as a subprocess.
+The report of a run is a JSON document, and the stage chosen for it is also run under cProfile.
+Pool workers count nothing, only what comes back to the parent is counted, and their time
+is CPU time of subprocesses once they are reaped.
+
+'''
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('cfl.profiling')
+
+_active = None
+
+# writing 5 resets the peak RSS of the process (Linux), which then gives the peak of every stage.
+CLEAR_REFS = '/proc/self/clear_refs'
+STATUS = '/proc/self/status'
+
+
+@contextmanager
+def stage(name):
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def _peak_rss():
+    # bytes, the peak since the last reset where it can be reset.
+    try:
+        with open(STATUS) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _reset_peak_rss():
+    try:
+        with open(CLEAR_REFS, 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _cpu_times():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def _count_git_execute():
+    # GitPython spawns a process per command, persistent cat-file ones included.
+    from git.cmd import Git
+    execute = Git.execute
+    if getattr(execute, 'counted', False):
+        return
+
+    def counted_execute(self, *args, **kwargs):
+        count('subprocesses')
+        return execute(self, *args, **kwargs)
+    counted_execute.counted = True
+    Git.execute = counted_execute
+
+
+class Frame():
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.cpu, self.children_cpu = _cpu_times()
+        self.peak_rss = 0
+
+
+class Profiler():
+
+    def __init__(self, name='run', profile_stage=None, profile_fname=None):
+        self.name = name
+        # the stage, by name or path, run under cProfile and dumped to profile_fname.
+        self.profile_stage = profile_stage
+        self.profile_fname = profile_fname
+        self.cprofile = None
+        self.profiling = False
+        self.stages = defaultdict(lambda: {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0,
+                                           'peak_rss': 0, 'counters': defaultdict(int)})
+        self.frames = []
+        self.started = None
+        self.previous = None
+
+    def __enter__(self):
+        global _active
+        _count_git_execute()
+        self.previous, _active = _active, self
+        self.started = time.time()
+        self.frames.append(Frame(''))
+        _reset_peak_rss()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self._finish(self.frames.pop(), self.stages[''])
+        _active = self.previous
+        if self.cprofile is not None and self.profile_fname:
+            self.cprofile.dump_stats(self.profile_fname)
+            logger.info('Dumped the profile of %s to %s', self.profile_stage, self.profile_fname)
+
+    @contextmanager
+    def stage(self, name):
+        path = '/'.join(filter(None, [self.frames[-1].path, name]))
+        # a profiled stage nested in itself is profiled once.
+        profiled = self.profile_stage in [name, path] and not self.profiling
+        # the peak of the enclosing stage so far is kept before it is reset.
+        self.frames[-1].peak_rss = max(self.frames[-1].peak_rss, _peak_rss())
+        _reset_peak_rss()
+        frame = Frame(path)
+        self.frames.append(frame)
+        if profiled:
+            self.cprofile = self.cprofile or cProfile.Profile()
+            self.profiling = True
+            self.cprofile.enable()
+        try:
+            yield
+        finally:
+            if profiled:
+                self.cprofile.disable()
+                self.profiling = False
+            self.frames.pop()
+            self._finish(frame, self.stages[path])
+            self.frames[-1].peak_rss = max(self.frames[-1].peak_rss, frame.peak_rss)
+
+    def _finish(self, frame, stats):
+        cpu, children_cpu = _cpu_times()
+        frame.peak_rss = max(frame.peak_rss, _peak_rss())
+        stats['calls'] += 1
+        stats['wall'] += time.perf_counter() - frame.start
+        stats['cpu'] += cpu - frame.cpu
+        stats['children_cpu'] += children_cpu - frame.children_cpu
+        stats['peak_rss'] = max(stats['peak_rss'], frame.peak_rss)
+
+    def count(self, name, n=1):
+        self.stages[self.frames[-1].path]['counters'][name] += n
+
+    def report(self):
+        '''
+        Return the stages by path, '' being the whole run, with the counts
+        made in a stage also summed into the stages around it as `total_counters`.
+        '''
+        stages = {}
+        for path, stats in sorted(self.stages.items()):
+            stats = dict(stats, counters=dict(stats['counters']))
+            stats['total_counters'] = defaultdict(int)
+            for other, other_stats in self.stages.items():
+                if other == path or path == '' or other.startswith(path + '/'):
+                    for counter, n in other_stats['counters'].items():
+                        stats['total_counters'][counter] += n
+            stats['total_counters'] = dict(stats['total_counters'])
+            stages[path] = stats
+        return {
+            'name': self.name,
+            'started': self.started,
+            'argv': sys.argv,
+            'pid': os.getpid(),
+            'profile_stage': self.profile_stage,
+            'profile_fname': self.profile_fname if self.cprofile is not None else None,
+            'stages': stages,
+        }
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        logger.info('Saved the profile report of %s to %s', self.name, fname)
@@ -27,12 +27,29 @@ class GitProject():
                 raise error.GitNotFoundError('It is not a git directory')
             self.name = name
             self.path = path.join(config.BASE_PATH, 'plt.'+lan, self.name)
-            self.repo = Repo(src_path, odbt=GitCmdObjectDB)
+            self.open_repo()
             self.level = level.lower()
             if level not in ['class', 'method', 'file']:
                 raise NotImplementedError('Only support method,class or file level.')
             self.path_dict = self.load_dirs()
     
+    def open_repo(self):
+        # a Repo keeps persistent git processes which must not be shared
+        # between processes, so it is reopened rather than pickled.
+        self.repo = Repo(self.src_path, odbt=GitCmdObjectDB)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['repo']
+        if hasattr(self.ref, 'hexsha'):
+            state['ref'] = self.ref.hexsha
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open_repo()
+        self.ref = self.repo.commit(self.ref)
+
     def load_goldsets(self):
             d = defaultdict(set)
 
@@ -66,18 +83,33 @@ class IssueGitProject(GitProject):
         data_path = path.join(base_path, 'data')
 
         query_path = path.join(data_path, 'queries')
-        makedirs(query_path) if not path.exists(query_path) else None
+        makedirs(query_path, exist_ok=True)
 
         goldset_path = path.join(data_path, 'goldsets', self.level)
-        makedirs(goldset_path) if not path.exists(goldset_path) else None
+        makedirs(goldset_path, exist_ok=True)
+
+        # shared by every level and goldset size, thus kept out of data_path.
+        cache_path = path.join(self.path, 'cache')
+        makedirs(cache_path, exist_ok=True)
 
         d = {}
         d['query'] = query_path
         d[self.level] = goldset_path
         d['data'] = data_path
         d['base'] = base_path
+        d['cache'] = cache_path
         return d
 
+    def goldset_params(self):
+        # everything the goldsets of the project depend on, see cache.stage_key.
+        return {
+            'kind': 'issue',
+            'lan': self.lan,
+            'level': self.level,
+            'by_release': list(self.by_release),
+            'issue_keywords': self.issue_keywords,
+        }
+
     def load_ids(self):
         fname = path.join(self.path_dict['data'], self.level+'_ids.txt')
         with open(fname) as f:
@@ -88,7 +120,7 @@ class CommitGitProject(GitProject):
     def __init__(self,name,lan,level,goldset_num=50,ref=None):
         self.goldset_num = goldset_num
         super().__init__(name,lan,level)
-        self.ref = self.repo.head.commit if not ref else ref
+        self.ref = self.repo.head.commit if not ref else self.repo.commit(ref)
 
     def load_dirs(self):
 
@@ -97,18 +129,32 @@ class CommitGitProject(GitProject):
         data_path = path.join(base_path, 'data')
 
         query_path = path.join(data_path, 'queries')
-        makedirs(query_path) if not path.exists(query_path) else None
+        makedirs(query_path, exist_ok=True)
 
         goldset_path = path.join(data_path, 'goldsets', self.level)
-        makedirs(goldset_path) if not path.exists(goldset_path) else None
+        makedirs(goldset_path, exist_ok=True)
+
+        # shared by every level and goldset size, thus kept out of data_path.
+        cache_path = path.join(self.path, 'cache')
+        makedirs(cache_path, exist_ok=True)
 
         d = {}
         d['query'] = query_path
         d[self.level] = goldset_path
         d['data'] = data_path
         d['base'] = base_path
+        d['cache'] = cache_path
         return d
 
+    def goldset_params(self):
+        return {
+            'kind': 'commit',
+            'lan': self.lan,
+            'level': self.level,
+            'goldset_num': self.goldset_num,
+            'ref': self.ref.hexsha,
+        }
+
     def load_ids(self):
         fname = path.join(self.path_dict['data'], self.level+'_ids.txt')
         with open(fname) as f:
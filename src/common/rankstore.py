@@ -0,0 +1,246 @@
+'''
+
+The module keeps the ranks of every configuration of a project in one append-only file,
+as typed columns rather than a CSV per model, level and configuration.
+
+A record holds the ranks of one configuration:
+    8 bytes    b'RNK1' and the length of the JSON header, little-endian
+    header     {'config': {...}, 'rows': n, 'strings': bytes of the string table, 'payload': bytes}
+    payload    query int32, rank int32, distance float64 and item int32 columns,
+               then the string table, NUL-separated UTF-8 that query and item index
+each part padded to 8 bytes so that columns are read in place with numpy.frombuffer.
+Records are only ever appended under an exclusive lock, the last one of a configuration
+replacing those before it. A record cut short by an interrupted write is ignored, and
+overwritten by the next append.
+
+'''
+import csv
+import fcntl
+import json
+import logging
+import os
+import struct
+from collections import OrderedDict, defaultdict
+
+import numpy
+
+logger = logging.getLogger('cfl.rankstore')
+
+MAGIC = b'RNK1'
+HEADER = struct.Struct('<4sI')
+COLUMNS = [
+    ('query', numpy.int32),
+    ('rank', numpy.int32),
+    ('distance', numpy.float64),
+    ('item', numpy.int32),
+]
+
+
+def _padding(size):
+    return -size % 8
+
+
+class RankStore():
+
+    def __init__(self, fname):
+        self.fname = fname
+        # key of a configuration -> (start of its record, start of its payload, header)
+        self.records = OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def key(config):
+        return json.dumps(config, sort_keys=True)
+
+    def _scan(self):
+        '''
+        Index the records appended since the last scan and return where the valid part of the file ends.
+        '''
+        if not os.path.exists(self.fname):
+            self.records.clear()
+            self.size = 0
+            return 0
+        size = os.path.getsize(self.fname)
+        if size < self.size:
+            # rewritten by compact.
+            self.records.clear()
+            self.size = 0
+        with open(self.fname, 'rb') as f:
+            f.seek(self.size)
+            while self.size + HEADER.size <= size:
+                magic, length = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC:
+                    break
+                raw = f.read(length)
+                if len(raw) < length:
+                    break
+                try:
+                    header = json.loads(raw.decode('utf-8'))
+                except ValueError:
+                    break
+                offset = self.size + HEADER.size + length + _padding(length)
+                end = offset + header['payload']
+                if end > size:
+                    break
+                key = self.key(header['config'])
+                self.records.pop(key, None)
+                self.records[key] = (self.size, offset, header)
+                self.size = end
+                f.seek(end)
+        return self.size
+
+    def configs(self):
+        self._scan()
+        return [header['config'] for _, _, header in self.records.values()]
+
+    def __contains__(self, config):
+        self._scan()
+        return self.key(config) in self.records
+
+    def append(self, config, ranks):
+        '''
+        Store ranks {query id: [(rank, distance, item), ...]} as read_ranks gives them
+        for `config`, a JSON serializable dict identifying the configuration.
+        '''
+        strings = {}
+        query, rank, distance, item = [], [], [], []
+        for qid, rels in ranks.items():
+            for idx, dist, fpath in rels:
+                query.append(strings.setdefault(qid, len(strings)))
+                rank.append(idx)
+                distance.append(dist)
+                item.append(strings.setdefault(fpath, len(strings)))
+
+        payload = []
+        for (_, dtype), values in zip(COLUMNS, (query, rank, distance, item)):
+            data = numpy.array(values, dtype=dtype).tobytes()
+            payload.extend([data, bytes(_padding(len(data)))])
+        table = '\0'.join(strings).encode('utf-8', 'surrogateescape')
+        payload.extend([table, bytes(_padding(len(table)))])
+        payload = b''.join(payload)
+
+        header = json.dumps({
+            'config': config,
+            'rows': len(rank),
+            'strings': len(table),
+            'payload': len(payload),
+        }).encode('utf-8')
+        record = b''.join([HEADER.pack(MAGIC, len(header)), header, bytes(_padding(len(header))), payload])
+
+        with open(self.fname, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # under the lock a record cut short can only be left by a
+                # writer which died, it is dropped.
+                f.truncate(self._scan())
+                f.write(record)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._scan()
+        logger.info('Appended %d ranks of %s to %s', len(rank), config, self.fname)
+
+    def _columns(self, data, offset, header):
+        columns = {}
+        for name, dtype in COLUMNS:
+            columns[name] = numpy.frombuffer(data, dtype=dtype, count=header['rows'], offset=offset)
+            size = header['rows'] * numpy.dtype(dtype).itemsize
+            offset += size + _padding(size)
+        table = bytes(data[offset:offset + header['strings']]).decode('utf-8', 'surrogateescape')
+        columns['strings'] = numpy.array(table.split('\0') if header['rows'] else [], dtype=str)
+        return columns
+
+    def load(self, config):
+        '''
+        Return the columns of `config` as NumPy arrays, query and item as strings,
+        or None if it is not stored.
+        '''
+        self._scan()
+        entry = self.records.get(self.key(config))
+        if entry is None:
+            return None
+        _, offset, header = entry
+        with open(self.fname, 'rb') as f:
+            f.seek(offset)
+            columns = self._columns(f.read(header['payload']), 0, header)
+        strings = columns.pop('strings')
+        columns['query'] = strings[columns['query']]
+        columns['item'] = strings[columns['item']]
+        return columns
+
+    def load_all(self):
+        '''
+        Return the configurations and the columns of all of them at once:
+        config indexes the configurations, query and item the shared strings.
+        '''
+        data = b''
+        if self._scan():
+            with open(self.fname, 'rb') as f:
+                data = f.read(self.size)
+        configs = []
+        parts = defaultdict(list)
+        n_strings = 0
+        for idx, (_, offset, header) in enumerate(self.records.values()):
+            configs.append(header['config'])
+            columns = self._columns(data, offset, header)
+            parts['config'].append(numpy.full(header['rows'], idx, dtype=numpy.int32))
+            parts['rank'].append(columns['rank'])
+            parts['distance'].append(columns['distance'])
+            parts['query'].append(columns['query'] + n_strings)
+            parts['item'].append(columns['item'] + n_strings)
+            parts['strings'].append(columns['strings'])
+            n_strings += len(columns['strings'])
+        columns = dict((name, numpy.concatenate(parts[name]) if parts[name] else numpy.zeros(0, dtype=dtype))
+                       for name, dtype in COLUMNS + [('config', numpy.int32)])
+        columns['strings'] = numpy.concatenate(parts['strings']) if parts['strings'] else numpy.zeros(0, dtype=str)
+        return configs, columns
+
+    def read(self, config):
+        # the {query id: [(rank, distance, item), ...]} of read_ranks.
+        ranks = defaultdict(list)
+        columns = self.load(config)
+        if columns is not None:
+            for qid, idx, dist, fpath in zip(columns['query'].tolist(), columns['rank'].tolist(),
+                                             columns['distance'].tolist(), columns['item'].tolist()):
+                ranks[qid].append((idx, dist, fpath))
+        return ranks
+
+    def export_csv(self, config, fname):
+        '''
+        Write the ranks of `config` as the CSV GeneralModel.write_ranks used to write.
+        '''
+        columns = self.load(config)
+        if columns is None:
+            raise KeyError('No ranks of {} in {}'.format(config, self.fname))
+        with open(fname, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'rank', 'distance', 'item'])
+            writer.writerows(zip(columns['query'].tolist(), columns['rank'].tolist(),
+                                 columns['distance'].tolist(), columns['item'].tolist()))
+
+    def compact(self, ignore=()):
+        '''
+        Rewrite the file with the last record of every configuration only,
+        while no other process reads the store. Configurations differing only
+        in the `ignore` fields count as one, e.g. ignoring the 'key' of a model
+        with a cache keeps the ranks of its last tree and goldset.
+        '''
+        with open(self.fname, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._scan()
+                data = f.read(self.size)
+                latest = OrderedDict()
+                for start, offset, header in self.records.values():
+                    key = self.key(dict((k, v) for k, v in header['config'].items() if k not in ignore))
+                    latest.pop(key, None)
+                    latest[key] = data[start:offset + header['payload']]
+                records = list(latest.values())
+                f.seek(0)
+                f.write(b''.join(records))
+                f.truncate()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.records.clear()
+        self.size = 0
+        self._scan()
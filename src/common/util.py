@@ -6,11 +6,14 @@ Utility Funcitons.
 
 '''
 
+import hashlib
 import logging
 import os
+from collections import deque
 import numpy
 import scipy
 import scipy.spatial
+import scipy.special
 from . import config
 import javalang
 
@@ -25,6 +28,49 @@ def cosine_distance(p, q):
     return scipy.spatial.distance.cosine(p, q)
 
 
+def hellinger_distance(p, q):
+    p = numpy.array(p, dtype=numpy.float64)
+    q = numpy.array(q, dtype=numpy.float64)
+    p = p / p.sum()
+    q = q / q.sum()
+    return numpy.sqrt(numpy.sum((numpy.sqrt(p) - numpy.sqrt(q)) ** 2)) / SQRT2
+
+
+def jensen_shannon_distance(p, q):
+    p = numpy.array(p, dtype=numpy.float64)
+    q = numpy.array(q, dtype=numpy.float64)
+    p = p / p.sum()
+    q = q / q.sum()
+    m = (p + q) / 2
+    divergence = (scipy.special.rel_entr(p, m).sum() + scipy.special.rel_entr(q, m).sum()) / 2
+    return numpy.sqrt(max(divergence, 0.0))
+
+
+def blob_sha(data):
+    # the sha git gives a blob with this content.
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def file_hash(*paths):
+    # sha1 of the content of files, directories are hashed file by file
+    # in sorted order.
+    digest = hashlib.sha1()
+    for p in paths:
+        if os.path.isdir(p):
+            fnames = sorted(os.path.join(dirpath, fname) for dirpath, _, fnames in os.walk(p) for fname in fnames)
+        else:
+            fnames = [p]
+        for fname in fnames:
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
 def score(model, fn):
     # thomas et al 2011 msr
     scores = list()
@@ -61,6 +107,19 @@ def obj_binary_search(objs, field, target):
 
 
 
+def ordered_imap(pool, func, iterable, window):
+    # like pool.imap, but at most `window` tasks are queued at once so that
+    # the consumer can stop early without the whole input being dispatched.
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+
 # def evaluate_mrr_with_frms(q_ranks):
 #     x =  [(1/metas[0][0]) for qid , metas in q_ranks.items()]
 #     return numpy.mean(x)
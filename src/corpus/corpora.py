@@ -8,15 +8,40 @@ import os
 import dulwich.patch
 import gensim
 import logging
+import json
+import multiprocessing
 import re
 import os
+import shutil
+from array import array
+
+import numpy
 from ..common.project import GitProject
 from ..common.error import NotGitProjectError
 from . import preprocessing
 from ..common import util
+from ..common import profiling
 
 logger = logging.getLogger('pfl.corpora')
 
+RESERVED_WORDS = {
+    'PYTHON': preprocessing.PYTHON_RESERVED,
+    'JAVA': preprocessing.JAVA_RESERVED,
+}
+
+_worker_corpus = None
+
+
+def _init_worker(corpus):
+    global _worker_corpus
+    _worker_corpus = corpus
+    # a forked worker must not share the git processes of its parent.
+    _worker_corpus.project.open_repo()
+
+
+def _process_worker(item):
+    return _worker_corpus._process(item)
+
 
 class GeneralCorpus(gensim.interfaces.CorpusABC):
     def __init__(self, project=None, id2word=None, split=True, lower=True, remove_stops=True, min_len=3, max_len=40, allow_update=True):
@@ -40,6 +65,11 @@ class GeneralCorpus(gensim.interfaces.CorpusABC):
         self.max_len = max_len
         self.allow_update = allow_update
 
+        # built once per corpus rather than once per document.
+        reserved_words = RESERVED_WORDS.get(getattr(project, 'lan', None), ())
+        self.stop_filter = preprocessing.StopFilter(preprocessing.FOX_STOPS, reserved_words,
+                                                    min_len=self.min_len, max_len=self.max_len)
+
         if not allow_update:
             self.id2word.add_documents(self.gen())
 
@@ -77,15 +107,10 @@ class GeneralCorpus(gensim.interfaces.CorpusABC):
             words = (word.lower() for word in words)
 
         if self.remove_stops:
-            words = preprocessing.remove_stops(words, preprocessing.FOX_STOPS)
-            if self.project.lan == 'PYTHON':
-                reversed_word = preprocessing.PYTHON_RESERVED
-            elif self.project.lan == 'JAVA':
-                reversed_word = preprocessing.JAVA_RESERVED
-            words = preprocessing.remove_stops(words, reversed_word)
-
-        words = (word for word in words if len(word) >=
-                 self.min_len and len(word) <= self.max_len)
+            words = self.stop_filter(words)
+        else:
+            words = (word for word in words if len(word) >=
+                     self.min_len and len(word) <= self.max_len)
         return words
 
     def __iter__(self):
@@ -104,10 +129,18 @@ class GeneralCorpus(gensim.interfaces.CorpusABC):
 
 class GitCorpus(GeneralCorpus):
 
-    def __init__(self, project, id2word=None, split=True, lower=True, remove_stops=True, min_len=3, max_len=40, allow_update=True):
+    def __init__(self, project, id2word=None, split=True, lower=True, remove_stops=True, min_len=3, max_len=40, allow_update=True, processes=1, known=None):
         if not isinstance(project, GitProject):
             raise error.NotGitProjectError
         else:
+            # number of worker processes reading and preprocessing files,
+            # 1 keeps everything in the current process.
+            self.processes = processes
+            # words of previously preprocessed files by blob sha, a file whose
+            # content is known is not preprocessed again.
+            self.known = known or {}
+            # blob sha of every file of the last pass by path.
+            self.blobs = {}
             super().__init__(
                 project=project,
                 id2word=id2word,
@@ -121,25 +154,135 @@ class GitCorpus(GeneralCorpus):
     def _make_meta(self, **kwargs):
         return kwargs
 
-    def gen(self):
-
-        length = 0
-
+    @property
+    def tree(self):
+        # the tree the corpus is built from: that of HEAD, combined with the blob sha
+        # of every source file which differs from it in the work tree, edited, added
+        # or deleted, so that uncommitted changes count as a change of the tree.
+        repo = self.project.repo
+        head = repo.head.commit.tree.hexsha
+        changed = repo.git.diff('--name-only', '-z', '--no-renames', 'HEAD').split('\0') + \
+            repo.git.ls_files('--others', '-z').split('\0')
+        changed = sorted(set(path for path in changed if path.endswith(util.LAN_EXT[self.project.lan])))
+        if not changed:
+            return head
+        files = []
+        for rel_path in changed:
+            fname = os.path.join(self.project.src_path, rel_path)
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    files.append([rel_path, util.blob_sha(f.read())])
+            else:
+                files.append([rel_path, None])
+        return util.text_hash(json.dumps([head, files]))
+
+    def _iter_files(self):
+        # yields (relative path, blob sha), the sha of a work tree file is
+        # only known once it is read.
         for dirpath, dirnames, filenames in os.walk(self.project.src_path):
             if '.git' in dirpath:
                 continue
             for filename in filenames:
                 if filename.endswith(util.LAN_EXT[self.project.lan]):
                     path = os.path.join(dirpath, filename)
-                    meta = (path[len(self.project.src_path) + 1:], 'corpus')
-                    with open(path,'rb') as f:
-                        document = f.read()
-                        words = self.preprocess(document)
-                        length += 1
-                        yield words, meta
+                    yield path[len(self.project.src_path) + 1:], None
+
+    def _read(self, rel_path, hexsha=None):
+        with open(os.path.join(self.project.src_path, rel_path), 'rb') as f:
+            return f.read()
+
+    def _process(self, item):
+        rel_path, hexsha = item
+        if hexsha in self.known_shas:
+            return rel_path, hexsha, None
+        document = self._read(rel_path, hexsha)
+        if hexsha is None:
+            hexsha = util.blob_sha(document)
+            if hexsha in self.known_shas:
+                return rel_path, hexsha, None
+        return rel_path, hexsha, list(self.preprocess(document))
+
+    def __getstate__(self):
+        # workers only need to know which blobs are known, not their words.
+        state = self.__dict__.copy()
+        state['known'] = {}
+        state['known_shas'] = frozenset(self.known)
+        return state
+
+    @property
+    def known_shas(self):
+        return self.__dict__.get('known_shas', self.known)
+
+    def gen(self):
+
+        length = 0
+        reused = 0
+        self.blobs = {}
+
+        if self.processes > 1:
+            # documents come back in walk order, with a bounded number of
+            # files in flight.
+            pool = multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(self,))
+            documents = util.ordered_imap(pool, _process_worker, self._iter_files(), self.processes * 16)
+        else:
+            pool = None
+            documents = (self._process(item) for item in self._iter_files())
+
+        try:
+            for rel_path, hexsha, words in documents:
+                if words is None:
+                    words = self.known[hexsha]
+                    reused += 1
+                    profiling.count('files_reused')
+                else:
+                    profiling.count('files_tokenized')
+                self.blobs[rel_path] = hexsha
+                length += 1
+                yield words, (rel_path, 'corpus')
+        finally:
+            if pool:
+                pool.terminate()
+        if self.known:
+            logger.info('Reused %d of %d documents', reused, length)
         self.length = length
 
 
+class RefCorpus(GitCorpus):
+    '''
+    A GitCorpus of the tree of `ref` (project.ref by default) read from the
+    object database, i.e. `git ls-tree -r` for the files and the persistent
+    `git cat-file --batch` process for their content, so no checkout is
+    needed and corpora of several refs can be built from one clone at once.
+    '''
+
+    def __init__(self, project, ref=None, **kwargs):
+        # kept as a hexsha so that the corpus can be pickled to workers.
+        self.ref = project.repo.commit(ref).hexsha if ref else project.ref.hexsha
+        super().__init__(project, **kwargs)
+
+    @property
+    def tree(self):
+        return self.project.repo.commit(self.ref).tree.hexsha
+
+    def _iter_files(self):
+        output = self.project.repo.git.ls_tree('-r', '-z', '--full-tree', self.ref)
+        for entry in output.split('\0'):
+            if not entry:
+                continue
+            meta, rel_path = entry.split('\t', 1)
+            mode, kind, hexsha = meta.split()
+            # symlinks and submodules are not source files, and paths
+            # under a .git* directory are skipped as the walk does.
+            if kind != 'blob' or mode == '120000' or '.git' in os.path.dirname(rel_path):
+                continue
+            if rel_path.endswith(util.LAN_EXT[self.project.lan]):
+                yield rel_path, hexsha
+
+    def _read(self, rel_path, hexsha=None):
+        _, _, _, data = self.project.repo.git.get_object_data(hexsha)
+        return data
+
+
 class OrderedCorpus(gensim.corpora.IndexedCorpus):
     def __init__(self, filename):
         self.fname = filename
@@ -268,3 +411,137 @@ class LabeledCorpus(gensim.corpora.IndexedCorpus):
         with gensim.utils.smart_open(self.fname) as f:
             f.seek(offset)
             return self.line2doc(f.readline())
+
+
+class BinaryCorpus(gensim.interfaces.CorpusABC):
+    '''
+    A corpus stored as flat arrays in the directory `fname`:
+        offsets.npy  int64, document i holds ids[offsets[i]:offsets[i + 1]]
+        ids.npy      int32 token ids in document order
+        meta.json    {"vocabulary": [token, ...], "docs": [[doc id, lang], ...]}
+    The arrays are memory-mapped and the tokens are never read whole: opening the corpus
+    loads meta.json, i.e. costs O(vocabulary + documents) rather than O(tokens),
+    and a document is then read by index in O(its length).
+
+    `view` selects what iterating yields, which makes it a drop-in for
+    the text corpora:
+        'bow'    bag of words over `id2word` as MalletCorpus, with (doc id, lang)
+                 when `metadata` is set. Without id2word the stored vocabulary is used.
+        'words'  (words, (doc id, lang)) as OrderedCorpus.
+        'tagged' TaggedDocument(words, ['DOC__<doc id>']) as LabeledCorpus.
+    '''
+
+    VIEWS = ('bow', 'words', 'tagged')
+
+    def __init__(self, fname, id2word=None, view='bow', metadata=False):
+        if view not in self.VIEWS:
+            raise ValueError('Unknown corpus view "{}".'.format(view))
+        self.fname = fname
+        self.view_name = view
+        self.metadata = metadata
+        with open(os.path.join(fname, 'meta.json')) as f:
+            meta = json.load(f)
+        self.vocabulary = meta['vocabulary']
+        self.docs = [tuple(doc) for doc in meta['docs']]
+        self.offsets = numpy.load(os.path.join(fname, 'offsets.npy'), mmap_mode='r')
+        self.ids = numpy.load(os.path.join(fname, 'ids.npy'), mmap_mode='r')
+        self.id2word = id2word
+        logger.info('Creating %s corpus for file %s', self.__class__.__name__, fname)
+
+    @property
+    def id2word(self):
+        return self._id2word
+
+    @id2word.setter
+    def id2word(self, val):
+        self._id2word = val
+        # stored token id -> id2word id, -1 for tokens id2word does not know.
+        if val is None:
+            self.remap = None
+        else:
+            token2id = val.token2id if hasattr(val, 'token2id') else dict((v, k) for k, v in val.items())
+            self.remap = numpy.array([token2id.get(token, -1) for token in self.vocabulary], dtype=numpy.int64)
+
+    def view(self, view, **kwargs):
+        return self.__class__(self.fname, id2word=kwargs.get('id2word', self.id2word), view=view,
+                              metadata=kwargs.get('metadata', self.metadata))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for docno in range(len(self)):
+            yield self[docno]
+
+    def __getitem__(self, docno):
+        if docno < 0:
+            docno += len(self)
+        if not 0 <= docno < len(self):
+            raise IndexError('document {} out of range'.format(docno))
+
+        ids = self.ids[self.offsets[docno]:self.offsets[docno + 1]]
+        doc_id, lang = self.docs[docno]
+        if self.view_name == 'bow':
+            doc = self._bow(ids)
+            return (doc, (doc_id, lang)) if self.metadata else doc
+
+        words = [self.vocabulary[idx] for idx in ids.tolist()]
+        if self.view_name == 'words':
+            return words, (doc_id, lang)
+        return gensim.models.doc2vec.TaggedDocument(words=words, tags=['DOC__%s' % doc_id])
+
+    def docbyoffset(self, offset):
+        # documents are addressed by position, see save_corpus.
+        return self[offset]
+
+    def _bow(self, ids):
+        if self.remap is not None:
+            ids = self.remap[ids]
+            ids = ids[ids >= 0]
+        word_ids, counts = numpy.unique(ids, return_counts=True)
+        return list(zip(word_ids.tolist(), counts.tolist()))
+
+    @classmethod
+    def serialize(cls, fname, corpus, id2word=None, metadata=True, **kwargs):
+        cls.save_corpus(fname, corpus, id2word=id2word, metadata=metadata)
+        return cls(fname, id2word=id2word, **kwargs)
+
+    @staticmethod
+    def save_corpus(fname, corpus, id2word=None, metadata=True):
+        '''
+        Store (words, (doc id, lang)) documents, from corpus.gen() if the corpus has it.
+        A given id2word is updated with every document as MalletCorpus.serialize
+        of a GitCorpus does. Return the offsets, i.e. the position of every document.
+        '''
+        logger.info('storing corpus in binary format into %s', fname)
+
+        vocabulary = {}
+        ids = array('i')
+        offsets = array('q', [0])
+        docs = []
+        documents = corpus.gen() if hasattr(corpus, 'gen') else corpus
+        for idx, doc in enumerate(documents):
+            if metadata:
+                words, (doc_id, doc_lang) = doc
+            else:
+                words, doc_id, doc_lang = doc, idx, '__unknown__'
+            words = list(words)
+            if id2word is not None:
+                id2word.doc2bow(words, allow_update=True)
+            for word in words:
+                ids.append(vocabulary.setdefault(word, len(vocabulary)))
+            offsets.append(len(ids))
+            docs.append([str(doc_id), doc_lang])
+
+        # written aside and moved in place, so that an interrupted run never
+        # leaves a corpus that looks complete.
+        tmp_fname = fname + '.tmp'
+        shutil.rmtree(tmp_fname, ignore_errors=True)
+        os.makedirs(tmp_fname)
+        numpy.save(os.path.join(tmp_fname, 'offsets.npy'), numpy.array(offsets, dtype=numpy.int64))
+        numpy.save(os.path.join(tmp_fname, 'ids.npy'), numpy.array(ids, dtype=numpy.int32))
+        with open(os.path.join(tmp_fname, 'meta.json'), 'w') as f:
+            json.dump({'vocabulary': sorted(vocabulary, key=vocabulary.get), 'docs': docs}, f)
+        shutil.rmtree(fname, ignore_errors=True)
+        os.replace(tmp_fname, fname)
+        return list(range(len(docs)))
@@ -5,6 +5,7 @@ The module is for preprocess.
 
 """
 
+import re
 import string
 import logging
 
@@ -29,74 +30,127 @@ def to_unicode(document, info=[]):
     return document
 
 # word splitting.
-def split(iterator):
-    for token in iterator:
-        word = u''
-        for char in token:
-            if char.isupper() and all(map(lambda x: x.isupper(), word)):
-                # keep building if word is currently all uppercase
-                word += char
-
-            elif char.islower() and all(map(lambda x: x.isupper(), word)):
-                # stop building if word is currently all uppercase,
-                # but be sure to take the first letter back
-                if len(word) > 1:
-                    yield word[:-1]
-                    word = word[-1]
-
-                word += char
-
-            elif char.islower() and any(map(lambda x: x.islower(), word)):
-                # keep building if the word is has any lowercase
-                # (word came from above case)
-                word += char
+# An ASCII token is split by a single regex: runs of capitals not followed by a
+# lowercase letter, a word with an optional leading capital, digit runs, and
+# any other character on its own. Other tokens go through the state machine
+# below, which keeps the same rules for every unicode character class.
+ASCII_WORD = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+|.', re.DOTALL)
+PUNCTUATION = frozenset(string.punctuation)
 
-            elif char.isdigit() and all(map(lambda x: x.isdigit(), word)):
-                # keep building if all of the word is a digit so far
-                word += char
 
-            elif char in string.punctuation:
-                if len(word) > 0:
-                    yield word
-                    word = u''
-
-                # always yield punctuation as a single token
-                yield char
-
-            else:
-                if len(word) > 0:
-                    yield word
-
-                word = char
+def split(iterator):
+    findall = ASCII_WORD.findall
+    for token in iterator:
+        if token.isascii():
+            yield from findall(token)
+        else:
+            yield from _split_unicode(token)
+
+
+def _split_unicode(token):
+    # the current word is token[start:i], which is all uppercase, all digits,
+    # or contains a lowercase letter.
+    start = 0
+    all_upper = all_digit = True
+    any_lower = False
+    for i, char in enumerate(token):
+        if char.isupper() and all_upper:
+            # keep building if word is currently all uppercase
+            all_digit = False
+            continue
+
+        elif char.islower() and all_upper:
+            # stop building if word is currently all uppercase,
+            # but be sure to take the first letter back
+            if i - start > 1:
+                yield token[start:i - 1]
+                start = i - 1
+            all_upper = all_digit = False
+            any_lower = True
+
+        elif char.islower() and any_lower:
+            # keep building if the word is has any lowercase
+            continue
+
+        elif char.isdigit() and all_digit:
+            # keep building if all of the word is a digit so far
+            all_upper = False
+            continue
+
+        elif char in PUNCTUATION:
+            if i > start:
+                yield token[start:i]
+
+            # always yield punctuation as a single token
+            yield char
+            start = i + 1
+            all_upper = all_digit = True
+            any_lower = False
+
+        else:
+            if i > start:
+                yield token[start:i]
+
+            start = i
+            all_upper = char.isupper()
+            all_digit = char.isdigit()
+            any_lower = char.islower()
+
+    if len(token) > start:
+        yield token[start:]
+
+
+class StopFilter():
+    '''
+    Drop stop words, integers and words whose length is out of [min_len, max_len] in a single pass.
+    The stop words are copied into a frozenset once, the given sets are never changed.
+    '''
 
-        if len(word) > 0:
+    def __init__(self, *stopwords, punctuation=True, digits=True, whitespace=True, min_len=0, max_len=None):
+        stops = set([''])
+        for words in stopwords:
+            stops.update(words)
+
+        if punctuation:
+            stops.update(string.punctuation)
+
+        if digits:
+            stops.update(string.digits)
+
+        if whitespace:
+            stops.update(string.whitespace)
+
+        self.stopwords = frozenset(stops)
+        self.min_len = min_len
+        self.max_len = max_len
+
+    def __call__(self, iterator):
+        stopwords = self.stopwords
+        min_len = self.min_len
+        max_len = self.max_len
+        for word in iterator:
+            if word in stopwords:
+                continue
+            if len(word) < min_len or (max_len is not None and len(word) > max_len):
+                continue
+            # int() only accepts words ending with a decimal digit or a space,
+            # so it is only tried on those.
+            last = word[-1]
+            if last.isdecimal() or last.isspace():
+                try:
+                    int(word)
+                    continue
+                except ValueError:
+                    pass
             yield word
 
 
-def remove_stops(iterator, stopwords=set(), punctuation=True, digits=True,
+def remove_stops(iterator, stopwords=(), punctuation=True, digits=True,
                  whitespace=True):
-    if not isinstance(stopwords, set):
-        stopwords = set(stopwords)
-
-    if punctuation:
-        stopwords.update(string.punctuation)
-
-    if digits:
-        stopwords.update(string.digits)
-
-    if whitespace:
-        stopwords.update(string.whitespace)
-
-    stopwords.update([''])
-    for word in filter(lambda x: x not in stopwords, iterator):
-        try:
-            int(word)
-            float(word)
-        except ValueError:
-            yield word
+    return StopFilter(stopwords, punctuation=punctuation, digits=digits, whitespace=whitespace)(iterator)
 
 
-FOX_STOPS = set(
+FOX_STOPS = frozenset(
     """ a about above across after again against all almost alone along already
     also although always among an and another any anybody anyone anything
     anywhere are area areas around as ask asked asking asks at away b back
@@ -133,7 +187,7 @@ FOX_STOPS = set(
     young younger youngest your yours z """.split())
 
 
-PYTHON_RESERVED = set(
+PYTHON_RESERVED = frozenset(
     '''
     and       del       from      not       while    
     as        elif      global    or        with     
@@ -145,7 +199,7 @@ PYTHON_RESERVED = set(
     '''.split())
 
 
-JAVA_RESERVED = set(
+JAVA_RESERVED = frozenset(
     """ abstract assert boolean break byte case catch char class const continue
     default do double else enum extends false final finally float for goto if
     implements import instanceof int interface long native new null package
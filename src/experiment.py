@@ -0,0 +1,253 @@
+'''
+
+Runs the models over many projects and parameter configurations and writes the MRR tables
+of the appendix, e.g. java.file.50.30.mrr.csv for 50 topics and 30 iterations.
+
+Projects are listed one per line as name,size,ref (appendix/java_ref_commit_size.csv) or
+name:size (appendix/5_java_projects.txt), and must be cloned under config.SOURCE_PATH.
+Given a ref, goldsets start from it and corpora are read from its tree rather than from
+the work tree, which is then left as it is.
+
+The work is split into tasks run on a process pool as soon as the tasks they depend on are done:
+    goldset  per project            generated unless its ids are already there
+    corpus   per project and model  the code corpus, shared by every configuration, after the goldset
+    query    per project and model  after the corpus
+    rank     per configuration      trains the model (or loads it) and ranks, after the query
+A failed task is logged and fails the tasks depending on it, its cells are left empty.
+
+Given --cache, goldsets, corpora, models and topics are kept in an ArtifactCache keyed by everything
+they are made from, and --dry-run lists which of them would be reused and which recomputed.
+Given --profile, every task writes the report of its stages there, e.g. rank.sympy.lda.500.30.json.
+
+usage: python -m src.experiment appendix/java_ref_commit_size.csv java file --num-topics 50 100 --iterations 30 --processes 4
+
+'''
+import argparse
+import csv
+import itertools
+import logging
+import os
+import re
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .common import config
+from .common import util
+from .common.cache import ArtifactCache, parse_size, stage_key
+from .common.profiling import Profiler
+from .common.project import CommitGitProject
+from .goldset.generator import CommitGoldsetGenerator
+from .models.model import DV, Lda, WordSum
+
+logger = logging.getLogger('experiment')
+
+MODELS = OrderedDict([
+    ('dv', DV),
+    ('lda', Lda),
+    ('wordsum', WordSum),
+])
+
+ProjectSpec = namedtuple('ProjectSpec', ['name', 'size', 'ref'])
+
+Task = namedtuple('Task', ['key', 'func', 'args', 'deps'])
+
+
+def load_projects(fname):
+    projects = []
+    with open(fname) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            name, size, *ref = re.split('[,:]', line.strip())
+            projects.append(ProjectSpec(name, int(size), ref[0] if ref else None))
+    return projects
+
+
+def _project(spec, lan, level, goldset_num):
+    return CommitGitProject(name=spec.name, lan=lan, level=level, goldset_num=goldset_num, ref=spec.ref)
+
+
+def _model(spec, lan, level, goldset_num, cache, model_name, corpus_format, num_topics=None, iterations=None):
+    # corpus and query tasks leave the configuration of the model to its defaults.
+    params = {} if num_topics is None else {'num_topics': num_topics, 'iterations': iterations}
+    return MODELS[model_name](_project(spec, lan, level, goldset_num), from_ref=spec.ref is not None,
+                              corpus_format=corpus_format, cache=cache, **params)
+
+
+def goldset_task(spec, lan, level, goldset_num, cache):
+    project = _project(spec, lan, level, goldset_num)
+    generator = CommitGoldsetGenerator(project, checkout=spec.ref is None)
+    if cache:
+        generator.generate_cached(cache)
+    elif not os.path.exists(os.path.join(project.path_dict['data'], level + '_ids.txt')):
+        generator.generate()
+    return len(project.load_ids())
+
+
+def corpus_task(*args):
+    return len(_model(*args).create_corpus())
+
+
+def query_task(*args):
+    return len(_model(*args).create_query())
+
+
+def rank_task(*args):
+    model = _model(*args)
+    # as read back by read_ranks, queries without ranked goldset items drop out.
+    ranks = dict((qid, rels) for qid, rels in model.get_ranks().items() if rels)
+    return float(util.calculate_mrr(ranks)) if ranks else float('nan')
+
+
+def profiled_task(fname, func, *args):
+    with Profiler(os.path.splitext(os.path.basename(fname))[0]) as profiler:
+        result = func(*args)
+    profiler.save(fname)
+    return result
+
+
+def plan(projects, lan, level, goldset_num=50, models=('dv', 'lda'), num_topics=(500,), iterations=(30,),
+         corpus_format='text', cache=None):
+    tasks = []
+    for spec in projects:
+        common = (spec, lan, level, goldset_num, cache)
+        tasks.append(Task(('goldset', spec.name), goldset_task, common, ()))
+        # the goldset generator recreates the project directories and, without a ref,
+        # checks master out, so nothing else of the project runs beside it.
+        for model_name in models:
+            tasks.append(Task(('corpus', spec.name, model_name), corpus_task,
+                              common + (model_name, corpus_format), (('goldset', spec.name),)))
+            tasks.append(Task(('query', spec.name, model_name), query_task,
+                              common + (model_name, corpus_format),
+                              (('corpus', spec.name, model_name),)))
+            for nt, it in itertools.product(num_topics, iterations):
+                tasks.append(Task(('rank', spec.name, model_name, nt, it), rank_task,
+                                  common + (model_name, corpus_format, nt, it),
+                                  (('query', spec.name, model_name),)))
+    return tasks
+
+
+def run_tasks(tasks, processes=1):
+    '''
+    Run every task once all its dependencies succeeded and return {key: result}.
+    Tasks which failed, or whose dependencies failed, are left out.
+    '''
+    pending = OrderedDict((task.key, task) for task in tasks)
+    results = {}
+    failed = set()
+    running = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while pending or running:
+            for key, task in list(pending.items()):
+                if any(dep in failed for dep in task.deps):
+                    logger.error('Skipping %s as a task it depends on failed', key)
+                    failed.add(key)
+                    del pending[key]
+                elif all(dep in results for dep in task.deps):
+                    running[executor.submit(task.func, *task.args)] = key
+                    del pending[key]
+            if not running:
+                # whatever is left waits on a task which is not planned.
+                for key in pending:
+                    logger.error('Skipping %s as a task it depends on is missing', key)
+                failed.update(pending)
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    results[key] = future.result()
+                    logger.info('Finished %s: %s', key, results[key])
+                except Exception:
+                    logger.exception('Task %s failed', key)
+                    failed.add(key)
+    return results
+
+
+def dry_run(tasks):
+    '''
+    Return [(stage, key, cached, task key), ...] telling for the artifact of every stage
+    of the planned tasks whether it would be reused, tasks with a cache only.
+    '''
+    report = []
+    seen = set()
+    for task in tasks:
+        if task.key[0] == 'goldset':
+            spec, lan, level, goldset_num, cache = task.args
+            stages = [('goldset', stage_key('goldset', **_project(spec, lan, level, goldset_num).goldset_params()))]
+            stages = [(stage, key, cache.contains(key, touch=False)) for stage, key in stages]
+        elif task.key[0] == 'rank':
+            stages = _model(*task.args).cached_stages()
+            if stages[-1][2]:
+                # stored ranks are read without the model.
+                stages = [stage for stage in stages if stage[0] in ['corpus', 'query', 'ranks']]
+        else:
+            continue
+        for stage, key, cached in stages:
+            if key not in seen:
+                seen.add(key)
+                report.append((stage, key, cached, task.key))
+    return report
+
+
+def write_tables(results, projects, lan, level, models=('dv', 'lda'), num_topics=(500,), iterations=(30,),
+                 output=config.BASE_PATH):
+    fnames = []
+    for nt, it in itertools.product(num_topics, iterations):
+        fname = os.path.join(output, '.'.join([lan, level, str(nt), str(it), config.MRR_EXT]))
+        with open(fname, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['project'] + [MODELS[name].__name__.upper() + '_MRR' for name in models])
+            for spec in projects:
+                row = [spec.name]
+                for model_name in models:
+                    row.append(results.get(('rank', spec.name, model_name, nt, it), ''))
+                writer.writerow(row)
+        fnames.append(fname)
+    return fnames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank with the models over projects and parameters and write MRR tables.')
+    parser.add_argument('projects', help='name,size,ref or name:size per line')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--models', choices=list(MODELS), nargs='+', default=['dv', 'lda'])
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--num-topics', type=int, nargs='+', default=[500])
+    parser.add_argument('--iterations', type=int, nargs='+', default=[30])
+    parser.add_argument('--corpus-format', choices=['text', 'binary'], default='text')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default=config.BASE_PATH)
+    parser.add_argument('--cache', help='directory of the artifact cache')
+    parser.add_argument('--cache-size', default=str(config.CACHE_SIZE), help='e.g. 500M or 20G')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be recomputed and exit')
+    parser.add_argument('--profile', help='directory of the profile report of every task')
+    args = parser.parse_args()
+    if args.dry_run and not args.cache:
+        parser.error('--dry-run needs --cache')
+
+    logging.basicConfig(level=config.LOG_LEVEL)
+    projects = load_projects(args.projects)
+    cache = ArtifactCache(args.cache, parse_size(args.cache_size)) if args.cache else None
+    tasks = plan(projects, args.lan, args.level, args.goldset_num, args.models,
+                 args.num_topics, args.iterations, args.corpus_format, cache)
+    if args.dry_run:
+        for stage, key, cached, task_key in dry_run(tasks):
+            print('{:9} {:12} {} {}'.format('reuse' if cached else 'recompute', stage, key[:12],
+                                            ' '.join(str(part) for part in task_key[1:])))
+        return
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        tasks = [task._replace(func=profiled_task, args=(
+            os.path.join(args.profile, '.'.join(str(part) for part in task.key) + '.json'), task.func) + task.args)
+            for task in tasks]
+    results = run_tasks(tasks, args.processes)
+    for fname in write_tables(results, projects, args.lan, args.level, args.models,
+                              args.num_topics, args.iterations, args.output):
+        print(fname)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,65 +8,144 @@ For Java, it only supports File/class level.
 '''
 import re
 import logging
-import javalang
 import logging
-from shutil import rmtree
+import multiprocessing
+from shutil import copytree, rmtree
 from javalang.parser import JavaParserError,JavaSyntaxError
 
 from itertools import chain
 from os import path
 from collections import defaultdict
-from typed_ast import ast3, ast27
 
 from ..common.project import CommitGitProject,IssueGitProject
 from ..common import util,config
+from ..common.blob import BlobCache
+from ..common.cache import stage_key
+from ..common import profiling
+from . import history
+from .structure import IntervalIndex, ParseCache
 
 logging.basicConfig(format='%(asctime)s : %(levelname)s : ' + '%(name)s : %(funcName)s : %(message)s')
 share_logger = logging.getLogger('goldset.public')
 
+_worker_generator = None
+
+
+def _read_key(fname):
+    if path.exists(fname):
+        with open(fname) as f:
+            return f.read()
+    return None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+    _worker_generator.project.open_repo()
+    _worker_generator.blobs.clear()
+    _worker_generator.parses.drain()
+
+
+def _extract_worker(item):
+    hexsha, diffs = item
+    commit = _worker_generator.project.repo.commit(hexsha)
+    goldset_set = _worker_generator._extract_single_goldset(commit, diffs)
+    # structures parsed here are persisted by the parent process.
+    return hexsha, goldset_set, _worker_generator.parses.drain()
+
 
 class GoldsetGenerator():
-    def __init__(self, project):
+    def __init__(self, project, diff_backend='commit', checkout=True):
         if self.__class__ == GoldsetGenerator:
             raise NotImplementedError
         else:
             self.project = project
             self.logger = logging.getLogger('goldset.private')
+            if diff_backend not in ['commit', 'log']:
+                raise NotImplementedError('Only support commit or log diff backend.')
+            # 'commit' diffs every commit through GitPython, 'log' streams
+            # the changes of the whole history from one git log process.
+            self.diff_backend = diff_backend
+            self.blobs = BlobCache(project)
+            self.parses = ParseCache(path.join(project.path_dict['cache'], config.PARSE_CACHE))
+
+            # goldsets are read from the object database, the checkout only
+            # lines the work tree up for a corpus built from it.
+            if checkout:
+                self._checkout_master()
+
+    def _checkout_master(self):
+        if 'master' in self.project.repo.heads:
+            self.project.repo.heads.master.checkout('-f')
+        else:
+            remote = self.project.repo.remote()
+            remote.fetch()
+            try:
+                self.project.repo.create_head('master', remote.refs.master)
+                self.project.repo.heads.master.set_tracking_branch(
+                    remote.refs.master)
+                self.project.repo.heads.master.checkout()
+            except AttributeError:
+                self.logger.info('cannot find master in local or remote repo thus just use current branch.')
+
+    def generate_cached(self, cache, **kwargs):
+        '''
+        generate, unless `cache` (an ArtifactCache) holds the goldsets of the same
+        project parameters, which are then copied into the data directory.
+        '''
+        key = stage_key('goldset', **self.project.goldset_params())
+        data_path = self.project.path_dict['data']
+        stamp = path.join(data_path, config.CACHE_KEY)
+        if cache.contains(key):
+            if _read_key(stamp) != key:
+                self.logger.info('restore goldsets {} from the cache.'.format(key))
+                rmtree(data_path)
+                copytree(cache.path(key), data_path)
+            return key
+
+        self.generate(**kwargs)
+        with open(stamp, 'w') as f:
+            f.write(key)
+        entry = cache.path(key)
+        rmtree(entry)
+        copytree(data_path, entry)
+        cache.store(key, 'goldset', project=self.project.name, **self.project.goldset_params())
+        return key
+
+    def _generate_single_goldset(self,commit,diffs=None):
+        goldset_set = self._extract_single_goldset(commit,diffs)
+        self._write_single_goldset(commit, goldset_set)
+        return commit.hexsha if goldset_set else None
 
-
-            if 'master' in self.project.repo.heads:
-                self.project.repo.heads.master.checkout('-f')
-            else:
-                remote = self.project.repo.remote()
-                remote.fetch()
-                try:
-                    self.project.repo.create_head('master', remote.refs.master)
-                    self.project.repo.heads.master.set_tracking_branch(
-                        remote.refs.master)
-                    self.project.repo.heads.master.checkout()
-                except AttributeError:
-                    self.logger.info('cannot find master in local or remote repo thus just use current branch.')
-
-                # checkout to master.
-
-    def _generate_single_goldset(self,commit):
+    @profiling.stage('extract')
+    def _extract_single_goldset(self,commit,diffs=None):
         goldset_set = None
         if self.project.lan == 'PYTHON':
             if self.project.level == 'file':
-                goldset_set = self._extract_goldset_from_commit_python_file_level(commit)
+                goldset_set = self._extract_goldset_from_commit_python_file_level(commit, diffs)
             elif self.project.level == 'class':
-                goldset_set = self._extract_goldset_from_commit_python_class_level(commit)
+                goldset_set = self._extract_goldset_from_commit_python_class_level(commit, diffs)
             elif self.project.level == 'method':
-                goldset_set = self._extract_goldset_from_commit_python_method_level(commit)
+                goldset_set = self._extract_goldset_from_commit_python_method_level(commit, diffs)
         elif self.project.lan == 'JAVA':
             if self.project.level == 'file':
-                goldset_set = self._extract_goldset_from_commit_java_file_level(commit)
-        
+                goldset_set = self._extract_goldset_from_commit_java_file_level(commit, diffs)
+        return goldset_set
+
+    def _write_single_goldset(self,commit,goldset_set):
         if goldset_set:
             with open(path.join(self.project.path_dict[self.project.level], commit.hexsha + '.txt'), 'w') as f:
                 [f.write(c + '\n') for c in goldset_set]
-    
-        return commit.hexsha if goldset_set else None
+
+    def _log_cache_stats(self):
+        blobs, parses = self.blobs.stats(), self.parses.stats()
+        self.logger.info('blob cache:{}'.format(blobs))
+        self.logger.info('parse cache:{}'.format(parses))
+        # the blobs read, diffs run and blobs parsed, what the caches did not have.
+        profiling.count('blobs_read', blobs['misses'])
+        profiling.count('diffs_run', blobs['diff_misses'] + blobs['diff_prefetched'])
+        profiling.count('blobs_parsed', parses['misses'])
+
     def _generate_single_query(self,commit):
         with open(path.join(self.project.path_dict['query'], '{idx}.txt'.format(idx=commit.hexsha)), 'w') as f:
             f.write(commit.message)
@@ -76,195 +155,174 @@ class GoldsetGenerator():
             content = ''.join([commit.hexsha, '\n'])
             f.write(content)
 
-    def _extract_goldset_from_commit_python_method_level(self, commit):
+    def _commit_diffs(self, commit, diffs=None):
+        # diffs may be handed over by a streaming backend, otherwise they
+        # are taken from GitPython against the first parent.
+        if diffs is not None:
+            return diffs
+        if not commit.parents:
+            return []
+        prev_commit = self.project.repo.commit(commit.hexsha + '~1')
+        diffs = prev_commit.diff(commit)
+        return chain(diffs.iter_change_type('A'), diffs.iter_change_type('M'))
+
+    def _prefetch_diffs(self, commit, diffs, ext):
+        modified = [diff for diff in diffs if diff.change_type == 'M' and diff.b_path.endswith(ext)]
+        if modified:
+            try:
+                self.blobs.prefetch_diffs(commit.parents[0], commit, modified)
+            except Exception as e:
+                # the diffs are then fetched file by file.
+                self.logger.warning(e)
+
+    def _extract_goldset_from_commit_python_method_level(self, commit, diffs=None):
         method_set = set()
         pattern = re.compile(r'\n@@(.+)@@\n')
-        if commit.parents:
-            prev_commit = self.project.repo.commit(commit.hexsha + '~1')
-            diffs = prev_commit.diff(commit)
-            diffs = chain(diffs.iter_change_type('A'), diffs.iter_change_type('M'))
-            for diff in diffs:
-                file_path = diff.b_path
-                try:
-                    if file_path.endswith('.py'):
-                        src_path = ':'.join([commit.hexsha, file_path])
-                        content = self.project.repo.git.show(src_path)
-                        try:
-                            nodes = ast27.parse(content).body
-                            ast = ast27
-                        except SyntaxError:
-                            nodes = ast3.parse(content).body
-                            ast = ast3
-                            
-                        if diff.change_type == 'M':
-                            diff_info = self.project.repo.git.diff(diff.a_blob, diff.b_blob)
-                            changes = pattern.findall(diff_info)
-                            for change in changes:
-                                t = change.strip().split('+')[1].split(',')
-                                if len(t) == 1:
-                                    continue
-                                else:
-                                    start_line, count = [int(x) for x in t]
-                                    end_line = start_line + count - 1
-                                    actual_start_line = start_line + 3 if start_line > 1 else start_line
-                                    actual_end_line = end_line - 3 if content.count('\n') != end_line else end_line
-
-                                    for node in nodes:
-                                        if node.__class__ == ast.FunctionDef:
-                                            if not (actual_start_line > node.body[-1].lineno or actual_end_line < node.lineno):
-                                                method_set.add('.'.join([file_path[:-3], node.name]))
-
-                                        elif node.__class__ == ast.ClassDef:
-                                            sub_nodes = node.body
-                                            for sub_node in sub_nodes:
-                                                if sub_node.__class__ == ast.FunctionDef:
-                                                    if not (actual_start_line > sub_node.body[-1].lineno or actual_end_line < sub_node.lineno):
-                                                        method_set.add('.'.join([file_path[:-3], node.name, sub_node.name]))
-
-                        elif diff.change_type == 'A':
-                            for node in nodes:
-                                if node.__class__ == ast.FunctionDef:
-                                    method_set.add('.'.join([file_path[:-3], node.name]))
-                                elif node.__class__ == ast.ClassDef:
-                                    sub_nodes = node.body
-                                    for sub_node in sub_nodes:
-                                        if sub_node.__class__ == ast.FunctionDef:
-                                            method_set.add('.'.join([file_path[:-3], node.name, sub_node.name]))
-
-                except IndexError as e:
-                    self.logger.warning('Error occurs while handing diff:{}'.format(diff))
-                    self.logger.warning(e)
-
-                except SyntaxError as e:
-                    self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
-
-                except Exception as e:
-                    self.logger.warning(e)
+        diffs = list(self._commit_diffs(commit, diffs))
+        self._prefetch_diffs(commit, diffs, '.py')
+        for diff in diffs:
+            file_path = diff.b_path
+            try:
+                if file_path.endswith('.py'):
+                    src_path = ':'.join([commit.hexsha, file_path])
+                    structure = self.parses.python(diff.b_blob, lambda: self.blobs.read(diff.b_blob))
+
+                    if diff.change_type == 'M':
+                        diff_info = self.blobs.diff(diff.a_blob, diff.b_blob)
+                        changes = pattern.findall(diff_info)
+                        index = IntervalIndex.from_structure(structure)
+                        for change in changes:
+                            t = change.strip().split('+')[1].split(',')
+                            if len(t) == 1:
+                                continue
+                            else:
+                                start_line, count = [int(x) for x in t]
+                                end_line = start_line + count - 1
+                                actual_start_line = start_line + 3 if start_line > 1 else start_line
+                                actual_end_line = end_line - 3 if structure['lines'] != end_line else end_line
+
+                                for name in index.overlaps(actual_start_line, actual_end_line):
+                                    method_set.add('.'.join([file_path[:-3], name]))
+
+                    elif diff.change_type == 'A':
+                        for name, _, _ in structure['functions']:
+                            method_set.add('.'.join([file_path[:-3], name]))
+                        for class_name, methods in structure['classes']:
+                            for name, _, _ in methods:
+                                method_set.add('.'.join([file_path[:-3], class_name, name]))
+
+            except IndexError as e:
+                self.logger.warning('Error occurs while handing diff:{}'.format(diff))
+                self.logger.warning(e)
+
+            except SyntaxError as e:
+                self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
+
+            except Exception as e:
+                self.logger.warning(e)
 
 
         return method_set
 
-    def _extract_goldset_from_commit_python_file_level(self, commit):
+    def _extract_goldset_from_commit_python_file_level(self, commit, diffs=None):
         file_set = set()
         
-        if commit.parents:
-            prev_commit = self.project.repo.commit(commit.hexsha + '~1')
-            diffs = prev_commit.diff(commit)
-            diffs = chain(diffs.iter_change_type('A'), diffs.iter_change_type('M'))
-            for diff in diffs:
-                file_path = diff.b_path
-                try:
-                    if file_path.endswith('.py'):
-                        file_set.add(file_path[:-3])
+        for diff in self._commit_diffs(commit, diffs):
+            file_path = diff.b_path
+            try:
+                if file_path.endswith('.py'):
+                    file_set.add(file_path[:-3])
                         
-                except IndexError as e:
-                    self.logger.warning('Error occurs while handing diff:{}'.format(diff))
-                    self.logger.warning(e)
+            except IndexError as e:
+                self.logger.warning('Error occurs while handing diff:{}'.format(diff))
+                self.logger.warning(e)
 
-                except SyntaxError as e:
-                    self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
+            except SyntaxError as e:
+                self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
 
-                except Exception as e:
-                    self.logger.warning(e)
+            except Exception as e:
+                self.logger.warning(e)
 
         return file_set
 
-    def _extract_goldset_from_commit_python_class_level(self, commit):
+    def _extract_goldset_from_commit_python_class_level(self, commit, diffs=None):
         class_set = set()
         pattern = re.compile(r'\n@@(.+)@@\n')
-        if commit.parents:
-            prev_commit = self.project.repo.commit(commit.hexsha + '~1')
-            diffs = prev_commit.diff(commit)
-            diffs = chain(diffs.iter_change_type('A'), diffs.iter_change_type('M'))
-            for diff in diffs:
-                file_path = diff.b_path
-                try:
-                    if file_path.endswith('.py'):
-                        src_path = ':'.join([commit.hexsha, file_path])
-                        content = self.project.repo.git.show(src_path)
-                        try:
-                            nodes = ast27.parse(content).body
-                            ast = ast27
-                        except SyntaxError:
-                            # self.logger.warning('Fail to parse {src} with Py2.7 AST.'.format(src=src_path))
-                            nodes = ast3.parse(content).body
-                            ast = ast3
-
-                        if diff.change_type == 'M':
-                            diff_info = self.project.repo.git.diff(diff.a_blob, diff.b_blob)
-                            changes = pattern.findall(diff_info)
-                            for change in changes:
-                                t = change.strip().split('+')[1].split(',')
-                                if len(t) == 1:
-                                    continue
-                                else:
-                                    start_line, count = [int(x) for x in t]
-                                    end_line = start_line + count - 1
-                                    actual_start_line = start_line + 3 if start_line > 1 else start_line
-                                    actual_end_line = end_line - 3 if content.count('\n') != end_line else end_line
-
-                                    for node in nodes:
-                                        if node.__class__ == ast.ClassDef:
-                                            class_set.add('.'.join([file_path[:-3], node.name]))
-
-                        elif diff.change_type == 'A':
-                            for node in nodes:
-                                if node.__class__ == ast.ClassDef:
-                                    class_set.add('.'.join([file_path[:-3], node.name]))
-
-                except IndexError as e:
-                    self.logger.warning('Error occurs while handing diff:{}'.format(diff))
-                    self.logger.warning(e)
-
-                except SyntaxError as e:
-                    self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
-
-                except Exception as e:
-                    self.logger.warning(e)
+        diffs = list(self._commit_diffs(commit, diffs))
+        self._prefetch_diffs(commit, diffs, '.py')
+        for diff in diffs:
+            file_path = diff.b_path
+            try:
+                if file_path.endswith('.py'):
+                    src_path = ':'.join([commit.hexsha, file_path])
+                    structure = self.parses.python(diff.b_blob, lambda: self.blobs.read(diff.b_blob))
+
+                    if diff.change_type == 'M':
+                        diff_info = self.blobs.diff(diff.a_blob, diff.b_blob)
+                        changes = pattern.findall(diff_info)
+                        for change in changes:
+                            t = change.strip().split('+')[1].split(',')
+                            if len(t) == 1:
+                                continue
+                            else:
+                                start_line, count = [int(x) for x in t]
+                                end_line = start_line + count - 1
+                                actual_start_line = start_line + 3 if start_line > 1 else start_line
+                                actual_end_line = end_line - 3 if structure['lines'] != end_line else end_line
+
+                                for class_name, _ in structure['classes']:
+                                    class_set.add('.'.join([file_path[:-3], class_name]))
+
+                    elif diff.change_type == 'A':
+                        for class_name, _ in structure['classes']:
+                            class_set.add('.'.join([file_path[:-3], class_name]))
+
+            except IndexError as e:
+                self.logger.warning('Error occurs while handing diff:{}'.format(diff))
+                self.logger.warning(e)
+
+            except SyntaxError as e:
+                self.logger.warning('Fail to parse {src} with Py3/Py2.7 AST hence pass.'.format(src=src_path))
+
+            except Exception as e:
+                self.logger.warning(e)
 
         return class_set
 
-    def _extract_goldset_from_commit_java_file_level(self, commit):
+    def _extract_goldset_from_commit_java_file_level(self, commit, diffs=None):
         goldset_set = set()
         pattern = re.compile(r'\n@@(.+)@@\n')
-        if commit.parents:
-            prev_commit = self.project.repo.commit(commit.hexsha + '~1')
-            diffs = prev_commit.diff(commit)
-            diffs = chain(diffs.iter_change_type('A'), diffs.iter_change_type('M'))
-            for diff in diffs:
-                file_path = diff.b_path
-                try:
-                    if file_path.endswith('.java'):
-                        src_path = ':'.join([commit.hexsha, file_path])
-                        content = self.project.repo.git.show(src_path)
-                        try:
-                            tree = javalang.parse.parse(content)
-                        except Exception as e:
-                            continue
-                        nodes = [node for _,node in tree.filter(javalang.tree.ClassDeclaration)]
-                        if nodes:
-                            goldset_set.add(file_path[:-5])
+        for diff in self._commit_diffs(commit, diffs):
+            file_path = diff.b_path
+            try:
+                if file_path.endswith('.java'):
+                    structure = self.parses.java(diff.b_blob, lambda: self.blobs.read(diff.b_blob))
+                    if structure is None:
+                        continue
+                    if structure['classes']:
+                        goldset_set.add(file_path[:-5])
                         
 
-                except IndexError as e:
-                    self.logger.warning('Error occurs while handing diff:{}'.format(diff))
-                    self.logger.warning(e)
+            except IndexError as e:
+                self.logger.warning('Error occurs while handing diff:{}'.format(diff))
+                self.logger.warning(e)
 
-                except Exception as e:
-                    raise e
+            except Exception as e:
+                raise e
 
         return goldset_set
 
 
 class CommitGoldsetGenerator(GoldsetGenerator):
 
-    def __init__(self, project):
+    def __init__(self, project, diff_backend='commit', checkout=True):
         if project.__class__  == CommitGitProject:
-            super().__init__(project)
+            super().__init__(project, diff_backend, checkout)
         else:
             raise TypeError('You shoud pass a "CommitGitProject" to this class of generation.')
 
-    def generate(self):
+    @profiling.stage('generate')
+    def generate(self, processes=1):
         rmtree(self.project.path_dict['data'])
         self.project.load_dirs()
         share_logger.info('{}'.format(self.project.name))
@@ -272,47 +330,103 @@ class CommitGoldsetGenerator(GoldsetGenerator):
         self.logger.info('use last commit {id} as start ref.'.format(id=start_commit.hexsha))
 
         share_logger.info('ref:{}'.format(start_commit.hexsha))
-        commit = start_commit
+        if processes > 1:
+            goldsets = self._iter_goldsets_parallel(start_commit, processes)
+        else:
+            goldsets = self._iter_goldsets(start_commit)
+
         goldset_count = 0
         commit_count = 0
-        while commit.parents:
-            idx = self._generate_single_goldset(commit)
-            commit_count += 1
-            if idx:
-                goldset_count += 1
-                self._generate_single_id(commit)
-                self._generate_single_query(commit)
-                if goldset_count == self.project.goldset_num:
-                    self.logger.info('{} goldsets have been generated.'.format(goldset_count))
-                    share_logger.info('goldset:{}'.format(goldset_count))
-                    share_logger.info('commit visited:{}\n'.format(commit_count))
-                    return
-            commit = self.project.repo.commit(commit.hexsha + '~1')
+        try:
+            for commit, goldset_set in goldsets:
+                commit_count += 1
+                profiling.count('commits_visited')
+                if goldset_set:
+                    goldset_count += 1
+                    profiling.count('goldsets')
+                    self._write_single_goldset(commit, goldset_set)
+                    self._generate_single_id(commit)
+                    self._generate_single_query(commit)
+                    if goldset_count == self.project.goldset_num:
+                        self.logger.info('{} goldsets have been generated.'.format(goldset_count))
+                        share_logger.info('goldset:{}'.format(goldset_count))
+                        share_logger.info('commit visited:{}\n'.format(commit_count))
+                        return
+        finally:
+            goldsets.close()
+            self.parses.save()
+            self._log_cache_stats()
 
         self.logger.info('run through all commits but got only {} goldsets.'.format(goldset_count))
         share_logger.info('goldset:{}'.format(goldset_count))
         share_logger.info('commit visited:{}\n'.format(commit_count))
 
+    def _iter_goldsets(self, start_commit):
+        if self.diff_backend == 'log':
+            for hexsha, diffs in self._iter_history(start_commit):
+                commit = self.project.repo.commit(hexsha)
+                yield commit, self._extract_single_goldset(commit, diffs)
+            return
+
+        commit = start_commit
+        while commit.parents:
+            yield commit, self._extract_single_goldset(commit)
+            commit = self.project.repo.commit(commit.hexsha + '~1')
+
+    def _iter_goldsets_parallel(self, start_commit, processes):
+        items = self._iter_history(start_commit)
+        self.logger.info('extract goldsets with {} processes.'.format(processes))
+
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+            for hexsha, goldset_set, parsed in util.ordered_imap(pool, _extract_worker, items, processes * 4):
+                self.parses.merge(parsed)
+                yield self.project.repo.commit(hexsha), goldset_set
+
+    def _iter_history(self, start_commit):
+        # yields (hexsha, diffs) along the first-parent history, skipping the
+        # root commit as the serial walk never visits it. diffs is None when
+        # they are left to be computed per commit.
+        if self.diff_backend == 'log':
+            for changes in history.iter_changes(self.project.repo, '--first-parent', start_commit.hexsha):
+                if changes.parents:
+                    yield changes.hexsha, changes.diffs
+        else:
+            lines = self.project.repo.git.rev_list('--first-parent', '--parents', start_commit.hexsha).splitlines()
+            for line in lines:
+                hexsha, *parents = line.split()
+                if parents:
+                    yield hexsha, None
+
 
 class IssueGoldsetGenerator(GoldsetGenerator):
-    def __init__(self, project):
+    def __init__(self, project, diff_backend='commit', checkout=True):
         if project.__class__ == IssueGitProject:
-            super().__init__(project)
+            super().__init__(project, diff_backend, checkout)
         else:
             raise TypeError('You shoud pass a "IssueGitProject" to this class of generation.')
 
+    @profiling.stage('generate')
     def generate(self):
         rmtree(self.project.path_dict['data'])
         self.project.load_dirs()
         pattern = re.compile('{types} #(\d+)'.format(types='|'.join(self.project.issue_keywords)))
         d = defaultdict(list)
 
-        commits = self.project.repo.iter_commits('{0}...{1}'.format(*self.project.by_release))
+        rev_range = '{0}...{1}'.format(*self.project.by_release)
+        if self.diff_backend == 'log':
+            commits = ((self.project.repo.commit(changes.hexsha), changes.diffs)
+                       for changes in history.iter_changes(self.project.repo, rev_range))
+        else:
+            commits = ((commit, None) for commit in self.project.repo.iter_commits(rev_range))
 
-        for commit in commits:
+        for commit, diffs in commits:
+            profiling.count('commits_visited')
             m = pattern.search(commit.message.lower())
             if m:
-                idx = self._generate_single_goldset(commit)
+                idx = self._generate_single_goldset(commit, diffs)
                 if idx:
+                    profiling.count('goldsets')
                     self._generate_single_id(commit)
                     self._generate_single_query(commit)
+        self.parses.save()
+        self._log_cache_stats()
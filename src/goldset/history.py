@@ -0,0 +1,85 @@
+'''
+
+This module streams the changed paths of a whole history from a single git process.
+It parses `git log --raw -z` incrementally and yields, for every commit,
+the same added/modified diffs GoldsetGenerator takes from GitPython,
+without a `git diff` round trip per commit.
+
+'''
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger('goldset.history')
+
+NULL_HEXSHA = '0' * 40
+COMMIT_MARK = '\x01'
+
+# mirrors the attributes of git.diff.Diff used by the goldset extractors,
+# blobs are given as hexsha strings.
+Change = namedtuple('Change', ['change_type', 'a_path', 'b_path', 'a_blob', 'b_blob'])
+
+CommitChanges = namedtuple('CommitChanges', ['hexsha', 'parents', 'diffs'])
+
+
+def iter_changes(repo, *args, chunksize=1 << 16):
+    '''
+    Yield CommitChanges for every commit listed by `git log <args>`.
+    Merges are diffed against their first parent as commit~1 is,
+    diffs holds the added paths followed by the modified ones.
+    '''
+    process = repo.git.log('--diff-merges=first-parent', '-M', '--raw', '-z', '--no-abbrev',
+                           '--format=' + COMMIT_MARK + '%H %P', *args, as_process=True)
+    stream = process.proc.stdout
+    try:
+        current = None
+        fields = _iter_fields(stream, chunksize)
+        for field in fields:
+            if field.startswith(COMMIT_MARK):
+                if current:
+                    yield _finish(current)
+                hexsha, *parents = field[1:].split()
+                current = (hexsha, parents, [])
+            elif field.startswith(':'):
+                meta = field[1:].split()
+                status = meta[4]
+                a_path = b_path = next(fields)
+                if status[0] in 'RC':
+                    b_path = next(fields)
+                current[2].append(_make_change(meta[2], meta[3], status[0], a_path, b_path))
+        if current:
+            yield _finish(current)
+    finally:
+        if process.proc.poll() is None:
+            process.proc.kill()
+        process.proc.wait()
+
+
+def _iter_fields(stream, chunksize):
+    buf = b''
+    while True:
+        chunk = stream.read(chunksize)
+        if not chunk:
+            break
+        buf += chunk
+        *fields, buf = buf.split(b'\0')
+        for field in fields:
+            yield field.decode('utf-8', 'surrogateescape').lstrip('\n')
+    if buf.strip(b'\n'):
+        yield buf.decode('utf-8', 'surrogateescape').lstrip('\n')
+
+
+def _make_change(a_blob, b_blob, change_type, a_path, b_path):
+    a_blob = None if a_blob == NULL_HEXSHA else a_blob
+    b_blob = None if b_blob == NULL_HEXSHA else b_blob
+    return Change(change_type, a_path, b_path, a_blob, b_blob)
+
+
+def _finish(current):
+    hexsha, parents, changes = current
+    if not parents:
+        # the serial walk never diffs a root commit.
+        return CommitChanges(hexsha, parents, [])
+    added = [c for c in changes if c.change_type == 'A']
+    modified = [c for c in changes if c.change_type == 'M' or
+                (c.a_blob and c.b_blob and c.a_blob != c.b_blob and c.change_type != 'A')]
+    return CommitChanges(hexsha, parents, added + modified)
@@ -0,0 +1,163 @@
+'''
+
+This module reduces a source file to the structure the goldset extractors need
+and caches it by blob sha, so that a blob is parsed once however many commits,
+levels or goldset sizes it is used for.
+
+A Python structure is
+    {'lines': number of newlines,
+     'functions': [[name, first line, line of last statement], ...],
+     'classes': [[name, [[method, first line, line of last statement], ...]], ...]}
+covering top-level functions and classes and the methods defined directly in a class.
+A Java structure is {'classes': [name, ...]} of every class declaration in the file.
+A file that cannot be parsed is cached as None.
+
+'''
+import bisect
+import json
+import logging
+from os import path
+
+import javalang
+from typed_ast import ast3, ast27
+
+logger = logging.getLogger('goldset.structure')
+
+
+def parse_python(content):
+    try:
+        nodes = ast27.parse(content).body
+        ast = ast27
+    except SyntaxError:
+        nodes = ast3.parse(content).body
+        ast = ast3
+
+    functions = []
+    classes = []
+    for node in nodes:
+        if node.__class__ == ast.FunctionDef:
+            functions.append([node.name, node.lineno, node.body[-1].lineno])
+        elif node.__class__ == ast.ClassDef:
+            methods = [[sub_node.name, sub_node.lineno, sub_node.body[-1].lineno]
+                       for sub_node in node.body if sub_node.__class__ == ast.FunctionDef]
+            classes.append([node.name, methods])
+    return {'lines': content.count('\n'), 'functions': functions, 'classes': classes}
+
+
+def parse_java(content):
+    tree = javalang.parse.parse(content)
+    return {'classes': [node.name for _, node in tree.filter(javalang.tree.ClassDeclaration)]}
+
+
+class IntervalIndex():
+    '''
+    Line ranges of the functions and methods of a Python structure sorted by first line,
+    answering which of them overlap a range of lines by binary search.
+    '''
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _, _ in intervals]
+        self.ends = [end for _, end, _ in intervals]
+        self.names = [name for _, _, name in intervals]
+        # running maximum of the ends, which keeps it sorted even if
+        # some ranges were nested.
+        self.max_ends = []
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    @classmethod
+    def from_structure(cls, structure):
+        intervals = [(start, end, name) for name, start, end in structure['functions']]
+        for class_name, methods in structure['classes']:
+            intervals.extend((start, end, '.'.join([class_name, name])) for name, start, end in methods)
+        return cls(intervals)
+
+    def overlaps(self, start_line, end_line):
+        '''
+        Return the dotted names whose range shares a line with [start_line, end_line].
+        '''
+        lo = bisect.bisect_left(self.max_ends, start_line)
+        hi = bisect.bisect_right(self.starts, end_line)
+        return [self.names[i] for i in range(lo, hi) if self.ends[i] >= start_line]
+
+
+class ParseCache():
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.entries = None
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.entries = {}
+        if path.exists(self.fname):
+            with open(self.fname) as f:
+                for line in f:
+                    try:
+                        kind, hexsha, structure = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interrupted run.
+                        continue
+                    self.entries[(kind, hexsha)] = structure
+        logger.info('Loaded %d parsed blobs from %s', len(self.entries), self.fname)
+
+    def python(self, hexsha, read):
+        '''
+        Return the structure of a Python blob, `read` is only called on a cache miss.
+        Raise SyntaxError if neither the Py2.7 nor the Py3 AST can parse it.
+        '''
+        structure = self._get('python', hexsha, read, parse_python, SyntaxError)
+        if structure is None:
+            raise SyntaxError('cannot parse blob {}'.format(hexsha))
+        return structure
+
+    def java(self, hexsha, read):
+        '''
+        Return the structure of a Java blob or None if javalang cannot parse it.
+        '''
+        return self._get('java', hexsha, read, parse_java, Exception)
+
+    def _get(self, kind, hexsha, read, parse, parse_error):
+        if self.entries is None:
+            self.load()
+
+        key = (kind, str(hexsha))
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        content = read()
+        try:
+            structure = parse(content)
+        except parse_error:
+            structure = None
+        self.entries[key] = structure
+        self.pending.append([kind, key[1], structure])
+        return structure
+
+    def drain(self):
+        pending, self.pending = self.pending, []
+        return pending
+
+    def merge(self, entries):
+        if self.entries is None:
+            self.load()
+        for kind, hexsha, structure in entries:
+            if (kind, hexsha) not in self.entries:
+                self.entries[(kind, hexsha)] = structure
+                self.pending.append([kind, hexsha, structure])
+
+    def save(self):
+        pending = self.drain()
+        if pending:
+            with open(self.fname, 'a') as f:
+                for entry in pending:
+                    f.write(json.dumps(entry) + '\n')
+            logger.info('Saved %d parsed blobs to %s', len(pending), self.fname)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
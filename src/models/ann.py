@@ -0,0 +1,183 @@
+'''
+
+The module answers nearest neighbour queries over document vectors approximately,
+so that a query does not have to be compared to every document.
+
+Vectors are hashed by the signs of their projections on random hyperplanes into several tables.
+The candidates of a query are the documents sharing a bucket with it in any table, or a bucket
+at hamming distance 1 when probing, and only they are ranked by cosine distance.
+Documents close in angle collide with high probability, the more tables the higher the recall.
+
+'''
+import logging
+import numpy
+
+from ..common import profiling
+
+logger = logging.getLogger('model.ann')
+
+
+class RandomProjectionIndex():
+
+    def __init__(self, doc_ids, vectors, tables=8, bits=None, probe=True, seed=0):
+        self.doc_ids = numpy.array(doc_ids, dtype=str)
+        self.vectors = self._normalize(vectors)
+        n_docs, dim = self.vectors.shape
+        if bits is None:
+            # about 8 documents per bucket.
+            bits = int(numpy.clip(numpy.log2(max(n_docs, 1) / 8.0), 1, 24))
+        self.bits = bits
+        self.probe = probe
+        self.seed = seed
+        self.planes = numpy.random.RandomState(seed).standard_normal((tables, bits, dim)).astype(numpy.float32)
+        self._build()
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = numpy.array(vectors, dtype=numpy.float32, ndmin=2)
+        norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _hash(self, vectors):
+        # (tables, n) bucket codes, bit b is the side of hyperplane b.
+        signs = numpy.einsum('tbd,nd->tnb', self.planes, vectors) > 0
+        return signs.astype(numpy.int64) @ (1 << numpy.arange(self.bits, dtype=numpy.int64))
+
+    def _build(self):
+        codes = self._hash(self.vectors)
+        # the documents of every table sorted by code, a bucket is then
+        # the range of one code found by binary search.
+        self.order = numpy.argsort(codes, axis=1, kind='stable')
+        self.codes = numpy.take_along_axis(codes, self.order, axis=1)
+        # position of every document when sorted by id, to break ties as
+        # RankingEngine does.
+        self.tie_order = numpy.empty(len(self.doc_ids), dtype=numpy.int64)
+        self.tie_order[numpy.argsort(self.doc_ids, kind='stable')] = numpy.arange(len(self.doc_ids))
+
+    def _ranges(self, codes):
+        '''
+        Return (query, start, stop) arrays of the bucket ranges in the flattened
+        order of every table for the (tables, n_queries) codes of the queries.
+        '''
+        flips = [0]
+        if self.probe:
+            flips.extend(1 << bit for bit in range(self.bits))
+        tables, n_queries = codes.shape
+        n_docs = self.codes.shape[1]
+        probes = codes[:, :, numpy.newaxis] ^ numpy.array(flips, dtype=numpy.int64)
+        queries, starts, stops = [], [], []
+        for table in range(tables):
+            wanted = probes[table].ravel()
+            lo = numpy.searchsorted(self.codes[table], wanted, side='left')
+            hi = numpy.searchsorted(self.codes[table], wanted, side='right')
+            hit = hi > lo
+            queries.append(numpy.repeat(numpy.arange(n_queries), len(flips))[hit])
+            starts.append(lo[hit] + table * n_docs)
+            stops.append(hi[hit] + table * n_docs)
+        return numpy.concatenate(queries), numpy.concatenate(starts), numpy.concatenate(stops)
+
+    def _candidates(self, codes):
+        # unique (query, document) pairs sharing a probed bucket.
+        queries, starts, stops = self._ranges(codes)
+        lengths = stops - starts
+        positions = numpy.arange(lengths.sum()) + numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+        docs = self.order.ravel()[positions]
+        pairs = numpy.sort(numpy.repeat(queries, lengths) * len(self.doc_ids) + docs)
+        pairs = pairs[numpy.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        return pairs // len(self.doc_ids), pairs % len(self.doc_ids)
+
+    def candidates(self, query_vector):
+        '''
+        Return the indices of the documents sharing a probed bucket with a query.
+        '''
+        _, docs = self._candidates(self._hash(self._normalize(query_vector)))
+        return docs
+
+    def top_k(self, query_matrix, k=10, chunksize=256):
+        '''
+        Return for every query the approximately k nearest documents as
+        [(cosine distance, doc id), ...], the shape RankingEngine.top_k gives.
+        A query with fewer than k candidates gets fewer results.
+        '''
+        queries = self._normalize(query_matrix)
+        results = []
+        for begin in range(0, len(queries), chunksize):
+            chunk = queries[begin:begin + chunksize]
+            # pairs come sorted by query, so every query owns one slice.
+            query_idx, docs = self._candidates(self._hash(chunk))
+            bounds = numpy.searchsorted(query_idx, numpy.arange(len(chunk) + 1))
+            profiling.count('distance_pairs', len(docs))
+            for query, lo, hi in zip(chunk, bounds[:-1], bounds[1:]):
+                candidates = docs[lo:hi]
+                distances = 1.0 - self.vectors[candidates] @ query
+                if k < len(candidates):
+                    # the k-th distance bounds the result, ties at it included.
+                    kth = numpy.partition(distances, k - 1)[k - 1]
+                    keep = distances <= kth
+                    candidates, distances = candidates[keep], distances[keep]
+                order = numpy.lexsort((self.tie_order[candidates], distances))[:k]
+                results.append([(float(distances[i]), str(self.doc_ids[candidates[i]])) for i in order])
+        return results
+
+    def save(self, fname, key=''):
+        # `key` identifies what the index was built from, see DV.create_index.
+        with open(fname, 'wb') as f:
+            numpy.savez(f, doc_ids=self.doc_ids, vectors=self.vectors, planes=self.planes,
+                        params=numpy.array([self.bits, int(self.probe), self.seed]), key=numpy.array(key))
+
+    @classmethod
+    def load(cls, fname):
+        with numpy.load(fname) as data:
+            index = cls.__new__(cls)
+            index.doc_ids = data['doc_ids']
+            index.vectors = data['vectors']
+            index.planes = data['planes']
+            index.bits, probe, index.seed = (int(value) for value in data['params'])
+            index.probe = bool(probe)
+            index.key = str(data['key'])
+        index._build()
+        return index
+
+
+def first_rank_mrr(results, goldsets):
+    '''
+    MRR over the queries of `goldsets` of [(distance, doc id), ...] result lists,
+    a query whose goldset is not in its list counts as 0.
+    '''
+    reciprocal = []
+    for qid, goldset in goldsets.items():
+        rank = next((idx + 1 for idx, (_, doc_id) in enumerate(results.get(qid, ())) if doc_id in goldset), None)
+        reciprocal.append(1.0 / rank if rank else 0.0)
+    return float(numpy.mean(reciprocal)) if reciprocal else 0.0
+
+
+def recall_report(index, engine, query_ids, query_matrix, goldsets, k=10):
+    '''
+    Compare the index with the exhaustive RankingEngine (cosine) over the same documents:
+    recall@k of the exhaustive top k, MRR of both result lists cut at k, and the mean
+    number of candidates ranked per query.
+    '''
+    query_ids = [str(qid) for qid in query_ids]
+    approximate = dict(zip(query_ids, index.top_k(query_matrix, k)))
+    exact = dict(zip(query_ids, engine.top_k(query_matrix, k)))
+
+    recalls = []
+    for qid in query_ids:
+        expected = set(doc_id for _, doc_id in exact[qid])
+        if expected:
+            found = set(doc_id for _, doc_id in approximate[qid])
+            recalls.append(len(expected & found) / len(expected))
+
+    query_idx, _ = index._candidates(index._hash(index._normalize(query_matrix)))
+    candidates = numpy.bincount(query_idx, minlength=len(query_ids))
+    goldsets = dict((qid, goldsets[qid]) for qid in query_ids if qid in goldsets)
+    return {
+        'k': k,
+        'queries': len(query_ids),
+        'documents': len(index.doc_ids),
+        'recall': float(numpy.mean(recalls)) if recalls else 0.0,
+        'exact_mrr': first_rank_mrr(exact, goldsets),
+        'approximate_mrr': first_rank_mrr(approximate, goldsets),
+        'candidates': float(numpy.mean(candidates)) if len(candidates) else 0.0,
+    }
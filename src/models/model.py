@@ -6,36 +6,178 @@ which are LDA,DV and word-summation.
 
 '''
 import csv
+import glob
+import json
 import os
 import logging
 import multiprocessing
+import numpy
 from gensim.corpora import Dictionary, MalletCorpus
-from gensim.models import Doc2Vec, LdaModel
-from gensim.matutils import sparse2full
-from collections import defaultdict
+from gensim.models import Doc2Vec, LdaModel, LdaMulticore
+from gensim import matutils
 
 
-from ..corpus.corpora import LabeledCorpus, OrderedCorpus, GeneralCorpus, GitCorpus
+from ..corpus.corpora import LabeledCorpus, OrderedCorpus, GeneralCorpus, GitCorpus, RefCorpus, BinaryCorpus
+from .ranking import RankingEngine
+from ..common.cache import stage_key
+from ..common.rankstore import RankStore
+from .ann import RandomProjectionIndex
 from ..common import util
 from ..common import config
+from ..common import profiling
+
+_worker_model = None
+
+
+def _init_worker(model_fname):
+    global _worker_model
+    _worker_model = Doc2Vec.load(model_fname)
+
+
+def _infer_worker(item):
+    words, seed = item
+    return infer_vector(_worker_model, words, seed)
+
+
+def infer_vector(model, words, seed):
+    # infer_vector draws from model.random, reseeding it makes the vector of
+    # a document the same whatever was inferred before and in which process.
+    model.random = numpy.random.RandomState(seed)
+    return model.infer_vector(words)
+
 
 # Abstract class cannot be instantiated 
 class GeneralModel():
     
-    def __init__(self, project):
+    def __init__(self, project, processes=1, incremental=False, from_ref=False, corpus_format='text', cache=None):
         self.project = project
+        # worker processes used to preprocess the code base.
+        self.processes = processes
+        # rebuild a stored corpus when its tree has changed,
+        # preprocessing only the added and modified files.
+        self.incremental = incremental
+        # read the code base from the tree of project.ref in the object
+        # database rather than from the checked out work tree.
+        self.from_ref = from_ref
+        if corpus_format not in ['text', 'binary']:
+            raise NotImplementedError('Only support text or binary corpus format.')
+        # 'text' keeps corpora as gzipped Mallet lines, 'binary' as
+        # memory-mapped BinaryCorpus arrays.
+        self.corpus_format = corpus_format
+        # an ArtifactCache keeping corpora, models and topics by the key of their
+        # stage, None keeps them under the project by number of topics and iterations.
+        self.cache = cache
+        # the tree of the code base, see corpus_tree.
+        self._tree = None
         self.logger = logging.getLogger('model')
         if self.__class__ == GeneralModel:
             raise NotImplementedError
 
-    def create_query(self):
+    def _corpus_fname(self, kind):
+        ext = config.BINARY_CORPUS_EXT if self.corpus_format == 'binary' else config.CORPUS_EXT
+        name = '.'.join([self.__class__.__name__, kind, ext])
+        if self.cache:
+            return os.path.join(self.cache.path(self.stage_key('corpus' if kind == 'code' else 'query')), name)
+        return os.path.join(self.project.path_dict['base'], name)
+
+    def _dict_fname(self):
+        return os.path.join(os.path.dirname(self._corpus_fname('code')),
+                            '.'.join([self.__class__.__name__, 'code', config.ID2WORD_EXT]))
+
+    def _preprocess_params(self):
+        corpus = GeneralCorpus(self.project)
+        return dict((name, getattr(corpus, name)) for name in ['split', 'lower', 'remove_stops', 'min_len', 'max_len'])
+
+    def _model_params(self):
+        raise NotImplementedError
+
+    def _topic_params(self):
+        return {}
+
+    def corpus_tree(self):
+        '''
+        Return the tree the code corpus is read from, see GitCorpus.tree.
+        It is read once per model, which stands for the code base as it was then:
+        every key of its stages, those its artifacts are looked up and stored by, agree.
+        '''
+        if self._tree is None:
+            self._tree = self._code_corpus().tree
+        return self._tree
+
+    def stage_key(self, stage):
+        '''
+        Return the cache key of 'corpus' (with its dictionary), 'query', 'model',
+        'topics.code', 'topics.query' or 'ranks', hashed from the parameters of
+        the stage and the keys of the stages it is made from.
+        A work tree corpus is keyed by the tree of HEAD and its uncommitted changes, see corpus_tree.
+        '''
+        name = self.__class__.__name__
+        if stage == 'corpus':
+            return stage_key(stage, model=name, format=self.corpus_format, lan=self.project.lan,
+                             tree=self.corpus_tree(), preprocess=self._preprocess_params())
+        if stage == 'query':
+            return stage_key(stage, model=name, format=self.corpus_format, preprocess=self._preprocess_params(),
+                             goldset=stage_key('goldset', **self.project.goldset_params()))
+        if stage == 'model':
+            return stage_key(stage, model=name, params=self._model_params(), corpus=self.stage_key('corpus'))
+        if stage in ['topics.code', 'topics.query']:
+            kind = stage.split('.')[1]
+            return stage_key('topics', kind=kind, params=self._topic_params(), model=self.stage_key('model'),
+                             corpus=self.stage_key('corpus' if kind == 'code' else 'query'))
+        if stage == 'ranks':
+            return stage_key(stage, goldset=stage_key('goldset', **self.project.goldset_params()),
+                             query=self.stage_key('topics.query'), code=self.stage_key('topics.code'))
+        raise ValueError('Unknown stage "{}".'.format(stage))
+
+    def _stored(self, stage, fname):
+        # whether the artifact of a stage at `fname` may be reused.
+        if self.cache:
+            return self.cache.contains(self.stage_key(stage)) and os.path.exists(fname)
+        return os.path.exists(fname)
+
+    def _store(self, stage):
+        if self.cache:
+            self.cache.store(self.stage_key(stage), stage.split('.')[0],
+                             project=self.project.name, model=self.__class__.__name__)
+
+    def cached_stages(self):
+        '''
+        Return [(stage, key, cached), ...] for the stages of get_ranks of a model with a cache,
+        cached telling whether get_ranks would reuse its artifact, without using any of them.
+        '''
+        stages = []
+        for stage in ['corpus', 'query', 'model', 'topics.code', 'topics.query', 'ranks']:
+            key = self.stage_key(stage)
+            if stage == 'ranks':
+                cached = self._rank_config() in self._rank_store()
+            else:
+                cached = self.cache.contains(key, touch=False)
+            stages.append((stage, key, cached))
+        return stages
+
+    def _load_words(self, corpus_fname):
+        # (words, (doc id, lang)) documents of either format.
+        if self.corpus_format == 'binary':
+            return BinaryCorpus(corpus_fname, view='words')
+        return OrderedCorpus(corpus_fname)
+
+    def _save_words(self, corpus_fname, corpus):
+        if self.corpus_format == 'binary':
+            BinaryCorpus.save_corpus(corpus_fname, corpus, metadata=True)
+        else:
+            OrderedCorpus.serialize(corpus_fname, corpus, metadata=True)
 
-        base_path = self.project.path_dict['base']
+    def _tagged(self, corpus):
+        if isinstance(corpus, BinaryCorpus):
+            return corpus.view('tagged')
+        return LabeledCorpus(corpus.fname)
 
-        corpus_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'query', config.CORPUS_EXT]))
+    def create_query(self):
+
+        corpus_fname = self._corpus_fname('query')
 
-        if os.path.exists(corpus_fname):
-            corpus = OrderedCorpus(corpus_fname)
+        if self._stored('query', corpus_fname):
+            corpus = self._load_words(corpus_fname)
 
         else:
             queries = []
@@ -48,102 +190,207 @@ class GeneralModel():
                 doc_vec = list(pp.preprocess(content))
                 queries.append((doc_vec, (idx, 'query')))
 
-            OrderedCorpus.serialize(corpus_fname, queries, metadata=True)
-            corpus = OrderedCorpus(corpus_fname)
+            self._save_words(corpus_fname, queries)
+            self._store('query')
+            corpus = self._load_words(corpus_fname)
         return corpus
 
     def create_corpus(self):
 
-        base_path = self.project.path_dict['base']
-
-        corpus_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code',  config.CORPUS_EXT]))
+        corpus_fname = self._corpus_fname('code')
 
-        if os.path.exists(corpus_fname):
-            corpus = OrderedCorpus(corpus_fname)
+        if not self._corpus_is_stale(corpus_fname):
+            corpus = self._load_words(corpus_fname)
 
         else:
-            corpus = GitCorpus(self.project)
+            corpus = self._git_corpus(corpus_fname)
 
-            OrderedCorpus.serialize(corpus_fname, corpus, metadata=True)
+            self._save_words(corpus_fname, corpus)
+            self._write_manifest(corpus)
+            self._store('corpus')
 
-            corpus = OrderedCorpus(corpus_fname)
+            corpus = self._load_words(corpus_fname)
 
         return corpus
 
+    def _manifest_fname(self):
+        return os.path.join(self.project.path_dict['base'],
+                            '.'.join([self.__class__.__name__, 'code', config.MANIFEST_EXT]))
+
+    def _read_manifest(self):
+        fname = self._manifest_fname()
+        if os.path.exists(fname):
+            with open(fname) as f:
+                return json.load(f)
+        return None
+
+    def _write_manifest(self, corpus):
+        manifest = {
+            'ref': str(self.project.ref),
+            'tree': self.corpus_tree(),
+            'corpus': self._corpus_fname('code'),
+            'files': corpus.blobs,
+        }
+        with open(self._manifest_fname(), 'w') as f:
+            json.dump(manifest, f)
+
+    def _corpus_is_stale(self, corpus_fname):
+        if not self._stored('corpus', corpus_fname):
+            return True
+        if not self.incremental:
+            return False
+        manifest = self._read_manifest()
+        return manifest is None or manifest['tree'] != self.corpus_tree()
+
+    def _code_corpus(self, known=None):
+        if self.from_ref:
+            return RefCorpus(self.project, processes=self.processes, known=known)
+        return GitCorpus(self.project, processes=self.processes, known=known)
+
+    def _git_corpus(self, corpus_fname):
+        # in incremental mode the words of the files whose blob is unchanged
+        # are taken from the stored corpus, which keeps them in the same
+        # "id lang words" lines for either serialization.
+        known = {}
+        manifest = self._read_manifest() if self.incremental else None
+        # a cached corpus of another tree is found through the manifest.
+        previous_fname = manifest.get('corpus', corpus_fname) if manifest else corpus_fname
+        if manifest and os.path.exists(previous_fname):
+            files = manifest['files']
+            for words, (doc_id, _) in self._load_words(previous_fname):
+                if doc_id in files:
+                    known[files[doc_id]] = words
+            self.logger.info('Rebuilding corpus from %d known files', len(known))
+        return self._code_corpus(known)
+
     def create_model(self):
         raise NotImplementedError
 
+    def _model_dir(self):
+        if self.cache:
+            return self.cache.path(self.stage_key('model'))
+        base_path = os.path.join(self.project.path_dict['base'], self.__class__.__name__, 'num_topics_' + str(self.num_topics) + '_iter_' + str(self.iterations))
+
+        # configurations of one model may be run side by side.
+        os.makedirs(base_path, exist_ok=True)
+        return base_path
+
+    def _model_fname(self):
+        return os.path.join(self._model_dir(), '.'.join([self.__class__.__name__, 'code', config.MODEL_EXT]))
+
+    def _model_key(self):
+        # gensim saves large arrays of a model aside, e.g. Lda.code.model.gz.expElogbeta.npz
+        model_fnames = sorted(glob.glob(os.path.splitext(self._model_fname())[0] + '*'))
+        return util.file_hash(*model_fnames)
+
+    def _cache_key(self, corpus):
+        parts = [self._model_key(), util.file_hash(corpus.fname)]
+        # e.g. the seed of DV inference, which changes the topics of the same model.
+        if self._topic_params():
+            parts.append(util.text_hash(json.dumps(self._topic_params(), sort_keys=True)))
+        return '.'.join(parts)
+
+    def get_cached_topics(self, model, corpus, kind):
+        '''
+        get_topics of the `kind` ('code' or 'query') corpus, kept as a .npy matrix
+        next to the model and keyed by the hashes of the model and corpus files,
+        so that it is only inferred again when one of them changes.
+        The cached matrix is memory-mapped.
+        '''
+        topics_dir = self.cache.path(self.stage_key('topics.' + kind)) if self.cache else self._model_dir()
+        fname = os.path.join(topics_dir, '.'.join([self.__class__.__name__, kind, config.TOPICS_EXT]))
+        meta_fname = fname[:-len('.npy')] + '.json'
+        key = self.stage_key('topics.' + kind) if self.cache else self._cache_key(corpus)
+
+        if os.path.exists(meta_fname) and os.path.exists(fname):
+            with open(meta_fname) as f:
+                meta = json.load(f)
+            if meta['key'] == key:
+                self.logger.info('load previous %s topics.', kind)
+                return numpy.array(meta['ids'], dtype=str), numpy.load(fname, mmap_mode='r')
+
+        ids, topics = self.get_topics(model, corpus)
+        # the key is written last, a matrix without it is never trusted.
+        if os.path.exists(meta_fname):
+            os.remove(meta_fname)
+        numpy.save(fname, topics)
+        with open(meta_fname, 'w') as f:
+            json.dump({'key': key, 'ids': ids.tolist()}, f)
+        self._store('topics.' + kind)
+        return ids, topics
+
     def predict(self, query_topic, doc_topic, distance_measure=util.cosine_distance):
+        # both are (ids, matrix) pairs as get_topics returns them.
+        query_ids, query_matrix = query_topic
+        doc_ids, doc_matrix = doc_topic
         self.logger.info('Getting ranks between %d query topics and %d doc topics',
-                    len(query_topic), len(doc_topic))
+                    len(query_ids), len(doc_ids))
         goldsets = self.project.load_goldsets()
-        ranks = {}
-        for qid, query in query_topic:
-            q_dist = []
-
-            for fpath, doc in doc_topic:
-                distance = distance_measure(query, doc)
-                q_dist.append((distance, fpath))
+        engine = RankingEngine(doc_ids, doc_matrix, measure=distance_measure)
+        ranks = engine.rank(query_ids, query_matrix, goldsets)
 
-            q_dist.sort()
-            if qid in goldsets:
-                goldset = goldsets[qid]
-                ranks[qid] = self.get_rels(goldset, q_dist)
-
-            else:
+        for qid in query_ids:
+            if qid not in goldsets:
                 self.logger.info("Could not find goldset for query %s", qid)
 
         self.logger.info('Returning %d ranks', len(ranks))
         return ranks
 
     def get_ranks(self):
-        ranks = self.read_ranks()
-        if not ranks:
-            corpus = self.create_corpus()
-            queries = self.create_query()
-            model = self.create_model(corpus)
-            query_topics = self.get_topics(model, queries)
-            doc_topics = self.get_topics(model, corpus)
-            ranks = self.predict(query_topics, doc_topics)
-            self.write_ranks(ranks)
-            ranks = self.read_ranks()
+        with profiling.stage('get_ranks'):
+            with profiling.stage('read_ranks'):
+                ranks = self.read_ranks()
+            if not ranks:
+                with profiling.stage('create_corpus'):
+                    corpus = self.create_corpus()
+                with profiling.stage('create_query'):
+                    queries = self.create_query()
+                with profiling.stage('create_model'):
+                    model = self.create_model(corpus)
+                with profiling.stage('get_topics'):
+                    query_topics = self.get_cached_topics(model, queries, 'query')
+                    doc_topics = self.get_cached_topics(model, corpus, 'code')
+                with profiling.stage('predict'):
+                    ranks = self.predict(query_topics, doc_topics)
+                with profiling.stage('write_ranks'):
+                    self.write_ranks(ranks)
+                    ranks = self.read_ranks()
         return ranks
-    
-    def get_rels(self, goldset, q_dist):
-        rels = []
-        for idx, rank in enumerate(q_dist):
-            distance, fpath = rank
-            if fpath in goldset:
-                rels.append((idx + 1, distance, fpath))
-        return rels
 
-    
+    def _rank_store(self):
+        # one store per project, shared by every goldset size, level, model and configuration.
+        return RankStore(os.path.join(self.project.path, config.RANK_STORE))
+
+    def _rank_config(self):
+        rank_config = {
+            'base': os.path.relpath(self.project.path_dict['base'], self.project.path),
+            'model': self.__class__.__name__,
+            'level': self.project.level,
+            'num_topics': self.num_topics,
+            'iterations': self.iterations,
+        }
+        if self.cache:
+            rank_config['key'] = self.stage_key('ranks')
+        return rank_config
+
+    def _rank_csv_fname(self):
+        return os.path.join(self._model_dir(), '.'.join([self.__class__.__name__, self.project.level, config.RANK_EXT]))
 
     def write_ranks(self, ranks):
-
-        base_path = os.path.join(self.project.path_dict['base'], self.__class__.__name__, 'num_topics_'+str(self.num_topics)+'_iter_'+str(self.iterations))
-
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
-
-        fname = os.path.join(base_path, '.'.join([self.__class__.__name__, self.project.level, config.RANK_EXT]))
-        if not os.path.exists(fname):
-            with open(fname, 'w') as f:
-                writer = csv.writer(f)
-                writer.writerow(['id', 'rank', 'distance', 'item'])
-                for qid, rank in ranks.items():
-                    for idx, distance, fpath in rank:
-                        writer.writerow([qid, idx, distance, fpath])
-        self.logger.info('Have written ranks to disk:{}'.format(fname))
+        store = self._rank_store()
+        if self._rank_config() not in store:
+            store.append(self._rank_config(), ranks)
+        self.logger.info('Have written ranks to disk:{}'.format(store.fname))
 
     def read_ranks(self):
-        ranks = defaultdict(list)
-        base_path = os.path.join(self.project.path_dict['base'], self.__class__.__name__, 'num_topics_' + str(self.num_topics) + '_iter_' + str(self.iterations))
-
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
-
-        fname = os.path.join(base_path, '.'.join([self.__class__.__name__, self.project.level, config.RANK_EXT]))
+        store = self._rank_store()
+        ranks = store.read(self._rank_config())
+        if ranks:
+            self.logger.info('Successfully loaded previous ranks from:{}'.format(store.fname))
+            return ranks
+
+        # ranks written as CSV before the store are moved into it.
+        fname = self._rank_csv_fname()
         if os.path.exists(fname):
             with open(fname, 'r') as f:
                 reader = csv.reader(f)
@@ -151,26 +398,55 @@ class GeneralModel():
                 for qid, idx, dist, d_path in reader:
                     ranks[qid].append((int(idx), float(dist), d_path))
             self.logger.info('Successfully loaded previous ranks from:{}'.format(fname))
+            if ranks:
+                store.append(self._rank_config(), ranks)
         return ranks
-    
+
+    def export_ranks(self, fname=None):
+        '''
+        Write the stored ranks as the CSV next to the model that write_ranks used to write.
+        '''
+        fname = fname or self._rank_csv_fname()
+        self._rank_store().export_csv(self._rank_config(), fname)
+        return fname
+
     def get_topics(self):
         raise NotImplementedError
 
+    def infer(self, model, words):
+        '''
+        Return the vector of one preprocessed query comparable to the rows of
+        get_topics, or None if none of its words is known to the model.
+        '''
+        raise NotImplementedError
+
 class Lda(GeneralModel):
-    def __init__(self, project, num_topics=500, chunksize=2000, passes=10, alpha='symmetric', iterations=30):
-        super().__init__(project)
+    def __init__(self, project, num_topics=500, chunksize=2000, passes=10, alpha='symmetric', iterations=30, processes=1, incremental=False, from_ref=False, corpus_format='text', workers=1, cache=None):
+        super().__init__(project, processes, incremental, from_ref, corpus_format, cache)
         self.num_topics = num_topics
         self.chunksize = chunksize
         self.passes = passes
         self.iterations = iterations
         self.alpha = alpha
+        # worker processes of the E-step, more than 1 trains with LdaMulticore.
+        self.workers = workers
+
+    def _model_params(self):
+        return {
+            'num_topics': self.num_topics,
+            'chunksize': self.chunksize,
+            'passes': self.passes,
+            'alpha': self.alpha,
+            'iterations': self.iterations,
+            # LdaMulticore does not update as LdaModel does.
+            'multicore': self.workers > 1,
+        }
 
     def create_query(self):
-        base_path = self.project.path_dict['base']
-        corpus_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'query', config.CORPUS_EXT]))
+        corpus_fname = self._corpus_fname('query')
         # dict_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'query', config.ID2WORD_EXT]))
-        dict_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code', config.ID2WORD_EXT]))
-        if not os.path.exists(corpus_fname):
+        dict_fname = self._dict_fname()
+        if not self._stored('query', corpus_fname):
             id2word = Dictionary()
             queries = []
             pp = GeneralCorpus(project=self.project)
@@ -180,119 +456,170 @@ class Lda(GeneralModel):
                     content = f.read()
 
                 doc_vec = list(pp.preprocess(content))
-                bow = id2word.doc2bow(doc_vec, allow_update=True)
-                queries.append((bow, (idx, 'query')))
-            MalletCorpus.serialize(corpus_fname, queries, id2word=id2word,metadata=True)
+                if self.corpus_format == 'binary':
+                    # stored as words and mapped to the code dictionary on load.
+                    queries.append((doc_vec, (idx, 'query')))
+                else:
+                    bow = id2word.doc2bow(doc_vec, allow_update=True)
+                    queries.append((bow, (idx, 'query')))
+            if self.corpus_format == 'binary':
+                BinaryCorpus.save_corpus(corpus_fname, queries, metadata=True)
+            else:
+                MalletCorpus.serialize(corpus_fname, queries, id2word=id2word,metadata=True)
+            self._store('query')
         else:
             self.logger.info('load previous queries.')
         id2word = None
         if os.path.exists(dict_fname):
             id2word = Dictionary.load(dict_fname)
+        if self.corpus_format == 'binary':
+            return BinaryCorpus(corpus_fname, id2word=id2word)
         corpus = MalletCorpus(corpus_fname, id2word=id2word)
         return corpus
 
     def create_corpus(self):
-        base_path = self.project.path_dict['base']
-
-        corpus_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code', config.CORPUS_EXT]))
-        dict_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code', config.ID2WORD_EXT]))
+        corpus_fname = self._corpus_fname('code')
+        dict_fname = self._dict_fname()
 
-        if os.path.exists(corpus_fname) and dict_fname:
+        if not self._corpus_is_stale(corpus_fname) and dict_fname:
             id2word = Dictionary.load(dict_fname)
             # corpus = MalletCorpus(corpus_fname, id2word=id2word,metadata=True)
             self.logger.info('load previous corpus.')
         else:
-            corpus = GitCorpus(self.project)
+            # the dictionary is rebuilt from every document, reused or not,
+            # so it matches the one a full rebuild gives.
+            corpus = self._git_corpus(corpus_fname)
 
             id2word = corpus.id2word
 
-            MalletCorpus.serialize(corpus_fname, corpus,id2word=id2word, metadata=True)
+            if self.corpus_format == 'binary':
+                BinaryCorpus.save_corpus(corpus_fname, corpus, id2word=id2word, metadata=True)
+            else:
+                MalletCorpus.serialize(corpus_fname, corpus,id2word=id2word, metadata=True)
+            self._write_manifest(corpus)
 
             id2word.save(dict_fname)
+            self._store('corpus')
 
+        if self.corpus_format == 'binary':
+            return BinaryCorpus(corpus_fname, id2word=id2word)
         corpus = MalletCorpus(corpus_fname, id2word=id2word)
 
         return corpus
 
     def create_model(self, corpus):
-        # base_path = self.project.path_dict['base']
-
-        base_path = os.path.join(self.project.path_dict['base'], self.__class__.__name__, 'num_topics_'+str(self.num_topics)+'_iter_'+str(self.iterations))
+        model_fname = self._model_fname()
 
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
-
-        model_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code',  config.MODEL_EXT]))
-
-        if os.path.exists(model_fname):
+        if self._stored('model', model_fname):
             self.logger.info('load previous Lda model.')
             model = LdaModel.load(model_fname)
         else:
-            model = LdaModel(corpus=corpus,
-                             id2word=corpus.id2word,
-                             num_topics=self.num_topics,
-                             alpha=self.alpha,
-                             chunksize=self.chunksize,
-                             passes=self.passes,
-                             iterations=self.iterations,
-                             eval_every=None,
-                             update_every=None)
+            model = self.train(corpus)
             
             model.save(model_fname)
+            self._store('model')
         
         return model
 
-    def get_topics(self,model, corpus, by_ids=None, full=True):
+    def train(self, corpus):
+        if self.workers > 1:
+            # batch=True keeps the one M-step per pass of update_every=None.
+            return LdaMulticore(corpus=corpus,
+                                id2word=corpus.id2word,
+                                num_topics=self.num_topics,
+                                workers=self.workers,
+                                alpha=self.alpha,
+                                chunksize=self.chunksize,
+                                passes=self.passes,
+                                iterations=self.iterations,
+                                eval_every=None,
+                                batch=True)
+        return LdaModel(corpus=corpus,
+                        id2word=corpus.id2word,
+                        num_topics=self.num_topics,
+                        alpha=self.alpha,
+                        chunksize=self.chunksize,
+                        passes=self.passes,
+                        iterations=self.iterations,
+                        eval_every=None,
+                        update_every=None)
+
+    def get_topics(self,model, corpus, by_ids=None):
+        '''
+        Return (ids, topics) where topics is a dense (n_docs, num_topics) float32
+        matrix of the topic distributions of the documents, inferred `chunksize`
+        documents at a time, and ids the parallel array of document ids.
+        '''
         self.logger.info('Getting doc topic for corpus with length %d', len(corpus))
-        doc_topic = list()
+        topics = numpy.empty((len(corpus), model.num_topics), dtype=numpy.float32)
+        ids = []
+        chunk = []
         corpus.metadata = True
         old_id2word = corpus.id2word
         corpus.id2word = model.id2word
 
-        for doc, meta in corpus:
-            if by_ids is None or metadata[0] in by_ids:
-                # get a vector where low topic values are zeroed out.
-                topics = model[doc]
-                if full:
-                    topics = sparse2full(topics, model.num_topics)
-
-                # this gets the "full" vector that includes low topic values
-                topics = model.__getitem__(doc, eps=0)
-                topics = [val for id, val in topics]
-
-                doc_topic.append((meta[0], topics))
-
-        corpus.metadata = False
-        corpus.id2word = old_id2word
-        self.logger.info('Returning doc topic of length %d', len(doc_topic))
-
-        return doc_topic
+        try:
+            for doc, meta in corpus:
+                if by_ids is None or meta[0] in by_ids:
+                    chunk.append(doc)
+                    ids.append(meta[0])
+                    if len(chunk) == self.chunksize:
+                        topics[len(ids) - len(chunk):len(ids)] = self._infer(model, chunk)
+                        chunk = []
+            if chunk:
+                topics[len(ids) - len(chunk):len(ids)] = self._infer(model, chunk)
+        finally:
+            corpus.metadata = False
+            corpus.id2word = old_id2word
+        self.logger.info('Returning doc topic of length %d', len(ids))
+
+        return numpy.array(ids, dtype=str), topics[:len(ids)]
+
+    def _infer(self, model, chunk):
+        # the normalized variational gamma is what model[doc] gives per
+        # document, without dropping topics below minimum_probability.
+        profiling.count('docs_inferred', len(chunk))
+        gamma, _ = model.inference(chunk)
+        return gamma / gamma.sum(axis=1, keepdims=True)
+
+    def infer(self, model, words):
+        bow = model.id2word.doc2bow(words)
+        if not bow:
+            return None
+        return self._infer(model, [bow])[0].astype(numpy.float32)
 
 
 class DV(GeneralModel):
-    def __init__(self, project, num_topics=500,iterations=30, min_count=1):
-        super().__init__(project)
+    def __init__(self, project, num_topics=500,iterations=30, min_count=1, processes=1, incremental=False, from_ref=False, corpus_format='text', seed=0, cache=None):
+        super().__init__(project, processes, incremental, from_ref, corpus_format, cache)
         self.num_topics = num_topics
         self.min_count = min_count
         self.iterations = iterations
+        # combined with the hash of a document to seed its inference.
+        self.seed = seed
 
-    def create_model(self, corpus):
-
-        base_path = os.path.join(self.project.path_dict['base'], self.__class__.__name__, 'num_topics_' + str(self.num_topics) + '_iter_' + str(self.iterations))
+    def _model_params(self):
+        return {
+            'num_topics': self.num_topics,
+            'iterations': self.iterations,
+            'min_count': self.min_count,
+            'window': 10,
+        }
 
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
+    def _topic_params(self):
+        return {'seed': self.seed}
 
-        # base_path = self.project.path_dict['base']
+    def create_model(self, corpus):
 
-        model_fname = os.path.join(base_path, '.'.join([self.__class__.__name__, 'code',  config.MODEL_EXT]))
+        model_fname = self._model_fname()
 
-        corpus = LabeledCorpus(corpus.fname)
+        corpus = self._tagged(corpus)
 
-        if not os.path.exists(model_fname):
+        if not self._stored('model', model_fname):
             # model = Doc2Vec(corpus, min_count=self.min_count, size=self.num_topics, workers=multiprocessing.cpu_count())
             model = Doc2Vec(corpus, min_count=self.min_count, vector_size=self.num_topics, workers=multiprocessing.cpu_count(), epochs=self.iterations,window=10)
             model.save(model_fname)
+            self._store('model')
 
         else:
             model = Doc2Vec.load(model_fname)
@@ -300,62 +627,181 @@ class DV(GeneralModel):
         return model
 
     def get_topics(self, model, corpus):
+        ids = []
         topic_arr = []
+        missing = []
         for doc, meta in corpus:
             try:
                 topics = model.docvecs['DOC__' + meta[0]]
             except KeyError:
-                topics = model.infer_vector(doc)
-            topic_arr.append((meta[0], topics))
-        return topic_arr
+                topics = None
+                missing.append((len(ids), doc))
+            ids.append(meta[0])
+            topic_arr.append(topics)
+        if missing:
+            for (idx, _), topics in zip(missing, self.infer_vectors(model, [doc for _, doc in missing])):
+                topic_arr[idx] = topics
+        topic_arr = numpy.array(topic_arr, dtype=numpy.float32).reshape(len(ids), -1)
+        return numpy.array(ids, dtype=str), topic_arr
+
+    def infer_vectors(self, model, docs):
+        '''
+        Return the inferred vectors of word lists, each seeded by its text hash so
+        that it is reproducible. Vectors are kept in a cache next to the model keyed
+        by that hash, valid for that model and seed only, and only documents new to
+        them are inferred, over `processes` workers.
+        '''
+        cache_fname = os.path.join(self._model_dir(), '.'.join([self.__class__.__name__, config.INFER_CACHE]))
+        model_key = self._model_key() if os.path.exists(self._model_fname()) else None
+        params = json.dumps(self._topic_params(), sort_keys=True)
+        cache = {}
+        if model_key and os.path.exists(cache_fname):
+            with numpy.load(cache_fname) as data:
+                if str(data['model']) == model_key and 'params' in data.files and str(data['params']) == params:
+                    cache = dict(zip(data['keys'].tolist(), data['vectors']))
+
+        keys = [util.text_hash(' '.join(doc)) for doc in docs]
+        todo = dict((key, doc) for key, doc in zip(keys, docs) if key not in cache)
+        self.logger.info('Inferring %d of %d documents', len(todo), len(docs))
+        profiling.count('docs_inferred', len(todo))
+        profiling.count('docs_inferred_cached', len(docs) - len(todo))
+        items = [(doc, self._seed(key)) for key, doc in todo.items()]
+        if self.processes > 1 and len(items) > 1 and model_key:
+            with multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(self._model_fname(),)) as pool:
+                vectors = pool.map(_infer_worker, items, chunksize=max(1, len(items) // (self.processes * 4)))
+        else:
+            vectors = [infer_vector(model, doc, seed) for doc, seed in items]
+        cache.update(zip(todo, vectors))
+
+        if todo and model_key:
+            with open(cache_fname, 'wb') as f:
+                numpy.savez(f, model=numpy.array(model_key), params=numpy.array(params),
+                            keys=numpy.array(list(cache), dtype=str),
+                            vectors=numpy.array(list(cache.values()), dtype=numpy.float32))
+        return [cache[key] for key in keys]
+
+    def _seed(self, key):
+        return int(key[:8], 16) ^ self.seed
+
+    def infer(self, model, words):
+        if not any(word in model.wv for word in words):
+            return None
+        return infer_vector(model, words, self._seed(util.text_hash(' '.join(words))))
+
+    def create_index(self, model, corpus, tables=8, bits=None):
+        '''
+        Return the approximate nearest neighbour index of the document vectors,
+        stored next to the model and rebuilt when the model, corpus or parameters change.
+        '''
+        index_fname = os.path.join(self._model_dir(), '.'.join([self.__class__.__name__, 'code', config.ANN_EXT]))
+        key = '.'.join([self._cache_key(corpus), str(tables), str(bits)])
+
+        if os.path.exists(index_fname):
+            index = RandomProjectionIndex.load(index_fname)
+            if index.key == key:
+                self.logger.info('load previous ANN index.')
+                return index
+
+        ids, vectors = self.get_cached_topics(model, corpus, 'code')
+        index = RandomProjectionIndex(ids, vectors, tables=tables, bits=bits)
+        index.save(index_fname, key)
+        return index
+
+    def top_k(self, model, queries, index, k=10):
+        '''
+        Return {query id: [(cosine distance, doc id), ...]} of the k nearest documents found by the index.
+        '''
+        ids, vectors = self.get_cached_topics(model, queries, 'query')
+        return dict(zip(ids.tolist(), index.top_k(vectors, k)))
 
 
 class WordSum(DV):
 
-    def __init__(self, project):
-        super().__init__(project)
+    def __init__(self, project, num_topics=500, iterations=30, from_ref=False, corpus_format='text', cache=None):
+        # the word vectors come from a DV model trained with these parameters.
+        super().__init__(project, num_topics=num_topics, iterations=iterations, from_ref=from_ref,
+                         corpus_format=corpus_format, cache=cache)
+
+    def get_topics(self, model, corpus):
+        '''
+        Return (ids, centroids) of the documents with a word in the model vocabulary,
+        a centroid being the unit-normalized mean vector of those words as n_similarity takes it.
+        '''
+        ids = []
+        centroids = []
+        for doc in self._tagged(corpus):
+            words = [word for word in doc.words if word in model.wv]
+            if words:
+                ids.append(doc.tags[0][5:])
+                centroids.append(matutils.unitvec(numpy.array([model.wv[word] for word in words]).mean(axis=0)))
+        centroids = numpy.array(centroids, dtype=numpy.float32).reshape(len(ids), model.vector_size)
+        profiling.count('docs_inferred', len(ids))
+        return numpy.array(ids, dtype=str), centroids
+
+    def infer(self, model, words):
+        words = [word for word in words if word in model.wv]
+        if not words:
+            return None
+        return matutils.unitvec(numpy.array([model.wv[word] for word in words]).mean(axis=0))
+
+    def _exact_near(self, engine, query, doc_centroids, row, goldset):
+        # the matrix product may round a similarity differently from the dot
+        # of one pair, which only matters between documents closer than
+        # WORDSUM_TIE_EPS to a goldset item, so those get the pair's value.
+        for item in goldset:
+            for idx in engine.positions.get(item, ()):
+                near = numpy.flatnonzero(numpy.abs(row - row[idx]) <= config.WORDSUM_TIE_EPS)
+                for other in near:
+                    row[other] = 1.0 - numpy.float64(numpy.dot(query, doc_centroids[other]))
 
     def predict(self, model, queries, corpus, by_ids=None):
 
-        queries = LabeledCorpus(queries.fname)
-        corpus = LabeledCorpus(corpus.fname)
         goldsets = self.project.load_goldsets()
         self.logger.info('Getting ranks for Doc2Vec model')
 
-        ranks = dict()
-        for query in queries:
-            q_dist = list()
+        doc_ids, doc_centroids = self.get_cached_topics(model, corpus, 'code')
+        query_ids, query_centroids = self.get_cached_topics(model, queries, 'query')
+        if by_ids is not None:
+            keep = [idx for idx, qid in enumerate(query_ids) if qid in by_ids]
+            query_ids, query_centroids = query_ids[keep], query_centroids[keep]
 
-            qid = query.tags[0][5:]
+        engine = RankingEngine(doc_ids, doc_centroids)
+        ranks = dict()
+        for start in range(0, len(query_ids), engine.chunksize):
+            chunk_ids = query_ids[start:start + engine.chunksize].tolist()
+            chunk = query_centroids[start:start + engine.chunksize]
+            profiling.count('distance_pairs', len(chunk) * len(doc_centroids))
+            block = 1.0 - (chunk @ doc_centroids.T).astype(numpy.float64)
+            for qid, query, row in zip(chunk_ids, chunk, block):
+                if qid in goldsets:
+                    self._exact_near(engine, query, doc_centroids, row, goldsets[qid])
+            ranks.update(engine.rank_block(chunk_ids, block, goldsets))
+
+        # a query without any word in the vocabulary ranks nothing.
+        for _, (qid, _) in queries:
             if by_ids is not None and qid not in by_ids:
-                self.logger.info('skipping')
                 continue
-            self.logger.info(qid)
-
-            qwords = list(filter(lambda x: x in model.wv.vocab, query.words))
-
-            for doc in corpus:
-                d_path = doc.tags[0].replace('DOC__', '')
-                dwords = list(filter(lambda x: x in model.wv.vocab, doc.words))
-
-                if len(dwords) and len(qwords):
-                    sim = model.n_similarity(qwords, dwords)
-                    q_dist.append((1.0 - sim, d_path))
-            q_dist.sort()
-            if qid in goldsets:
-                goldset = goldsets[qid]
-                ranks[qid] = self.get_rels(goldset, q_dist)
-            else:
+            if qid not in goldsets:
                 self.logger.info("Could not find goldset for query %s", qid)
+            elif qid not in ranks:
+                ranks[qid] = []
 
         return ranks
 
     def get_ranks(self):
-        ranks = self.read_ranks()
-        if not ranks:
-            queries = self.create_query()
-            corpus = self.create_corpus()
-            model = self.create_model(corpus)
-            ranks = self.predict(model, queries, corpus)
-            self.write_ranks(ranks)
+        with profiling.stage('get_ranks'):
+            with profiling.stage('read_ranks'):
+                ranks = self.read_ranks()
+            if not ranks:
+                with profiling.stage('create_query'):
+                    queries = self.create_query()
+                with profiling.stage('create_corpus'):
+                    corpus = self.create_corpus()
+                with profiling.stage('create_model'):
+                    model = self.create_model(corpus)
+                # the centroids are taken while ranking.
+                with profiling.stage('predict'):
+                    ranks = self.predict(model, queries, corpus)
+                with profiling.stage('write_ranks'):
+                    self.write_ranks(ranks)
         return ranks
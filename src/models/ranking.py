@@ -0,0 +1,164 @@
+'''
+
+The module ranks documents against queries with dense matrix operations.
+Query and document vectors are stacked into matrices once and the distances
+of a chunk of queries to every document are computed in a single pass.
+
+Supported measures are cosine, hellinger and jensen_shannon, the latter two
+expect topic distributions (e.g. the output of LDA) rather than arbitrary vectors.
+
+'''
+import logging
+import numpy
+import scipy.special
+
+from ..common import util
+from ..common import profiling
+
+logger = logging.getLogger('model.ranking')
+
+MEASURES = {
+    util.cosine_distance: 'cosine',
+    util.hellinger_distance: 'hellinger',
+    util.jensen_shannon_distance: 'jensen_shannon',
+}
+
+# upper bound of float64 cells materialized at once by jensen_shannon.
+JS_BUFFER_SIZE = 2 ** 24
+
+
+class RankingEngine():
+
+    def __init__(self, doc_ids, doc_matrix, measure='cosine', chunksize=256):
+        self.measure = self.resolve(measure)
+        self.chunksize = chunksize
+        self.doc_ids = list(doc_ids)
+        self.doc_matrix = self._prepare(doc_matrix)
+
+        self.positions = {}
+        for idx, doc_id in enumerate(self.doc_ids):
+            self.positions.setdefault(doc_id, []).append(idx)
+
+        # position of every document when sorted by id, used to break ties
+        # the same way sorting (distance, id) tuples does.
+        order = sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__)
+        self.tie_order = numpy.empty(len(order), dtype=numpy.int64)
+        self.tie_order[order] = numpy.arange(len(order))
+
+    @staticmethod
+    def resolve(measure):
+        if measure in MEASURES.values():
+            return measure
+        if measure in MEASURES:
+            return MEASURES[measure]
+        if callable(measure):
+            return measure
+        raise ValueError('Unknown distance measure "{}".'.format(measure))
+
+    def _prepare(self, matrix):
+        matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+
+        if self.measure == 'cosine':
+            norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            return matrix / norms
+
+        if self.measure in ('hellinger', 'jensen_shannon'):
+            sums = matrix.sum(axis=1, keepdims=True)
+            sums[sums == 0] = 1.0
+            matrix = matrix / sums
+            return numpy.sqrt(matrix) if self.measure == 'hellinger' else matrix
+
+        return matrix
+
+    def distances(self, query_matrix):
+        '''
+        Yield (start, block) where block holds the distances of the queries
+        query_matrix[start:start + len(block)] to every document.
+        '''
+        query_matrix = self._prepare(query_matrix)
+        chunksize = self.chunksize
+        if self.measure == 'jensen_shannon':
+            cells = max(1, self.doc_matrix.size)
+            chunksize = max(1, min(chunksize, JS_BUFFER_SIZE // cells))
+
+        for start in range(0, len(query_matrix), chunksize):
+            chunk = query_matrix[start:start + chunksize]
+            profiling.count('distance_pairs', len(chunk) * len(self.doc_matrix))
+            yield start, self._distance_block(chunk)
+
+    def _distance_block(self, chunk):
+        if self.measure == 'cosine':
+            return 1.0 - chunk @ self.doc_matrix.T
+
+        if self.measure == 'hellinger':
+            # both sides are square roots of distributions, so they are unit
+            # vectors and ||a - b||^2 / 2 = 1 - a.b
+            return numpy.sqrt(numpy.clip(1.0 - chunk @ self.doc_matrix.T, 0.0, None))
+
+        if self.measure == 'jensen_shannon':
+            p = chunk[:, numpy.newaxis, :]
+            q = self.doc_matrix[numpy.newaxis, :, :]
+            m = (p + q) / 2
+            divergence = (scipy.special.rel_entr(p, m).sum(axis=2) +
+                          scipy.special.rel_entr(q, m).sum(axis=2)) / 2
+            return numpy.sqrt(numpy.clip(divergence, 0.0, None))
+
+        return numpy.array([[self.measure(query, doc) for doc in self.doc_matrix] for query in chunk])
+
+    def rank(self, query_ids, query_matrix, goldsets):
+        '''
+        Return {query id: [(rank, distance, doc id), ...]} for the goldset items
+        of every query, ordered by rank, rank being the 1-based position of the
+        item among all documents sorted by (distance, doc id).
+        Queries without goldset are skipped.
+        '''
+        ranks = {}
+        query_ids = list(query_ids)
+        for start, block in self.distances(query_matrix):
+            ranks.update(self.rank_block(query_ids[start:start + len(block)], block, goldsets))
+        return ranks
+
+    def rank_block(self, query_ids, block, goldsets):
+        '''
+        Rank precomputed distances as rank does, block[i] holding the distances
+        of the query query_ids[i] to every document.
+        '''
+        ranks = {}
+        for qid, row in zip(query_ids, block):
+            if qid in goldsets:
+                ranks[qid] = self._rels(row, goldsets[qid])
+        return ranks
+
+    def _rels(self, row, goldset):
+        rels = []
+        for item in goldset:
+            for idx in self.positions.get(item, ()):
+                distance = row[idx]
+                ties = row == distance
+                rank = numpy.count_nonzero(row < distance) + \
+                    numpy.count_nonzero(self.tie_order[ties] < self.tie_order[idx]) + 1
+                rels.append((int(rank), float(distance), item))
+        rels.sort()
+        return rels
+
+    def top_k(self, query_matrix, k=10):
+        '''
+        Return for every query the k nearest documents as [(distance, doc id), ...].
+        '''
+        k = min(k, len(self.doc_ids))
+        results = []
+        for _, block in self.distances(query_matrix):
+            for row in block:
+                if k < len(row):
+                    # the k-th distance bounds the result, ties at it included,
+                    # so that they are broken by id as rank breaks them.
+                    kth = numpy.partition(row, k - 1)[k - 1]
+                    idxs = numpy.flatnonzero(row <= kth)
+                else:
+                    idxs = numpy.arange(len(row))
+                idxs = idxs[numpy.lexsort((self.tie_order[idxs], row[idxs]))][:k]
+                results.append([(float(row[idx]), self.doc_ids[idx]) for idx in idxs])
+        return results
@@ -0,0 +1,204 @@
+'''
+
+The module serves feature location queries over HTTP from a trained model.
+The model, its corpus and document-topic matrix are loaded once, queries are preprocessed
+with GeneralCorpus.preprocess as the stored queries are, and ranked against every file.
+
+    GET  /query?q=<text>&k=10      top k files of a query
+    POST /query {"query": <text>, "k": 10}
+    GET  /metrics                  request count, errors, latency percentiles and throughput
+    GET  /health                   model and number of documents
+
+usage: python -m src.models.server sympy python file --model lda --num-topics 500 --port 8000
+
+'''
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy
+
+from ..common.project import CommitGitProject
+from ..corpus.corpora import GeneralCorpus
+from .model import DV, Lda, WordSum
+from .ranking import RankingEngine
+
+logger = logging.getLogger('model.server')
+
+MODELS = {
+    'lda': Lda,
+    'dv': DV,
+    'wordsum': WordSum,
+}
+
+
+class Metrics():
+
+    def __init__(self, window=1024):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        # (finished at, latency) of the last `window` requests.
+        self.recent = deque(maxlen=window)
+
+    def record(self, latency, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.total_latency += latency
+            self.recent.append((time.time(), latency))
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            recent = list(self.recent)
+            uptime = now - self.started
+            snapshot = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'uptime': uptime,
+                'throughput': self.requests / uptime if uptime > 0 else 0.0,
+                'mean_latency': self.total_latency / self.requests if self.requests else 0.0,
+            }
+        latencies = numpy.array([latency for _, latency in recent])
+        if len(latencies):
+            for q in (50, 95, 99):
+                snapshot['p{}_latency'.format(q)] = float(numpy.percentile(latencies, q))
+            snapshot['max_latency'] = float(latencies.max())
+            span = now - recent[0][0] + recent[0][1]
+            snapshot['recent_throughput'] = len(recent) / span if span > 0 else 0.0
+        return snapshot
+
+
+class QueryService():
+
+    def __init__(self, model):
+        self.model = model
+        corpus = model.create_corpus()
+        self.trained = model.create_model(corpus)
+        doc_ids, doc_topics = model.get_cached_topics(self.trained, corpus, 'code')
+        self.engine = RankingEngine(doc_ids, doc_topics)
+        self.preprocessor = GeneralCorpus(project=model.project)
+        # inference draws from the model's random state.
+        self.lock = threading.Lock()
+        self.metrics = Metrics()
+        logger.info('Serving %s over %d documents', model.__class__.__name__, len(doc_ids))
+
+    def query(self, text, k=10):
+        start = time.perf_counter()
+        try:
+            words = list(self.preprocessor.preprocess(text))
+            with self.lock:
+                vector = self.model.infer(self.trained, words)
+            ranked = self.engine.top_k(vector, k)[0] if vector is not None else []
+        except Exception:
+            self.metrics.record(time.perf_counter() - start, error=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return {
+            'query': text,
+            'words': words,
+            'results': [{'file': doc_id, 'distance': distance, 'score': 1.0 - distance}
+                        for distance, doc_id in ranked],
+        }
+
+    def health(self):
+        return {'model': self.model.__class__.__name__, 'documents': len(self.engine.doc_ids)}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/query':
+            params = parse_qs(url.query)
+            self._query(params.get('q', [None])[0], params.get('k', [10])[0])
+        elif url.path == '/metrics':
+            self._reply(200, self.server.service.metrics.snapshot())
+        elif url.path == '/health':
+            self._reply(200, self.server.service.health())
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/query':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self._reply(400, {'error': 'body is not JSON'})
+            return
+        self._query(body.get('query'), body.get('k', 10))
+
+    def _query(self, text, k):
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            k = 0
+        if not text or k < 1:
+            self._reply(400, {'error': 'a query and a positive k are required'})
+            return
+        try:
+            self._reply(200, self.server.service.query(text, k))
+        except Exception as e:
+            logger.exception('Query %r failed', text)
+            self._reply(500, {'error': str(e)})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        super().__init__(address, QueryHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve feature location queries of a trained model.')
+    parser.add_argument('name')
+    parser.add_argument('lan')
+    parser.add_argument('level')
+    parser.add_argument('--model', choices=sorted(MODELS), default='lda')
+    parser.add_argument('--goldset-num', type=int, default=50)
+    parser.add_argument('--num-topics', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--corpus-format', choices=['text', 'binary'], default='text')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    project = CommitGitProject(name=args.name, lan=args.lan, level=args.level, goldset_num=args.goldset_num)
+    model = MODELS[args.model](project, num_topics=args.num_topics, iterations=args.iterations,
+                               corpus_format=args.corpus_format)
+
+    server = QueryServer((args.host, args.port), QueryService(model))
+    print('Serving {} on http://{}:{}'.format(args.model, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+
+Golden output checks of preprocessing: split and StopFilter must give exactly what the
+character by character implementations kept in benchmark.preprocessing gave, on real
+Python and Java source and on identifier edge cases.
+
+usage: python -m pytest tests
+
+'''
+import os
+
+import pytest
+
+from src.benchmark.preprocessing import reference_filter, reference_split
+from src.corpus import preprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JAVA_SOURCE = u'''
+package org.apache.commons.lang3.text;
+
+import java.util.concurrent.ConcurrentHashMap;
+
+/**
+ * Parses an HTTPResponse into a {@link URLMap}, see RFC2616 section 4.2.
+ */
+@SuppressWarnings("unchecked")
+public final class XMLHttpRequestParser<K extends Comparable<K>, V> implements Serializable {
+
+    private static final long serialVersionUID = 20110518L;
+    private static final int MAX_UTF8_BYTES = 0x7FFFFFFF;
+    private final ConcurrentHashMap<String, List<V>> headersByName = new ConcurrentHashMap<>();
+
+    public int getHTTPResponseCode(final String rawHeader, int[] offsets) throws IOException {
+        if (rawHeader == null || rawHeader.isEmpty()) {
+            throw new IllegalArgumentException("rawHeader must not be empty: " + rawHeader);
+        }
+        double ratio = 1.5e-3d * offsets.length;
+        char separator = '\\t';
+        String naïveCafé = "Größe";
+        return parseURL2JSON(rawHeader).toUpperCase().hashCode() >>> 3 & MAX_UTF8_BYTES;
+    }
+
+    @Override
+    protected void iOSCompat$handler_v2(long x86_64) { this.headersByName.clear(); }
+}
+'''
+
+IDENTIFIERS = [
+    '', 'a', 'A', 'aB', 'Ab', 'ABc', 'abC', 'HTTPServer', 'getHTTPResponseCode', 'XMLHttpRequest',
+    'parseURL2JSON', 'a1b2c3', 'abc123DEF', '123abc', '__init__', 'snake_case_name', 'ALL_CAPS_99',
+    'iOS', 'x86_64', '$value', 'foo.bar()', 'a-b+c', 'naïveCafé', 'ÉcoleNormale', 'straße', 'ǅungla',
+    'ǅUngla', '日本語Name', 'Name日本語', 'ÀÉÎõü', 'ⅣRoman', 'ﬁleName', '١٢٣abc', 'x²', 'ΣίσυφοςΦ',
+    'emoji😀Name', 'tab\tname', ' ', ' nbsp',
+]
+
+
+def python_sources():
+    for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT, 'src')):
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                yield os.path.join(dirpath, filename)
+
+
+def read(fname):
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+def tokens_of(document):
+    return list(preprocessing.tokenize(preprocessing.to_unicode(document)))
+
+
+def test_split_identifiers():
+    for identifier in IDENTIFIERS:
+        assert list(preprocessing.split([identifier])) == list(reference_split([identifier])), identifier
+    assert list(preprocessing.split(IDENTIFIERS)) == list(reference_split(IDENTIFIERS))
+
+
+@pytest.mark.parametrize('fname', list(python_sources()), ids=lambda fname: os.path.relpath(fname, ROOT))
+def test_split_python_source(fname):
+    tokens = tokens_of(read(fname))
+    assert list(preprocessing.split(tokens)) == list(reference_split(tokens))
+
+
+def test_split_java_source():
+    tokens = tokens_of(JAVA_SOURCE.encode('utf-8'))
+    assert list(preprocessing.split(tokens)) == list(reference_split(tokens))
+
+
+@pytest.mark.parametrize('source, reserved', [
+    (JAVA_SOURCE.encode('utf-8'), preprocessing.JAVA_RESERVED),
+    (b'\n'.join(read(fname) for fname in python_sources()), preprocessing.PYTHON_RESERVED),
+])
+def test_stop_filter(source, reserved):
+    words = [word.lower() for word in preprocessing.split(tokens_of(source))]
+    stop_filter = preprocessing.StopFilter(preprocessing.FOX_STOPS, reserved, min_len=3, max_len=40)
+    assert list(stop_filter(words)) == list(reference_filter(words, reserved, 3, 40))
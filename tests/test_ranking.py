@@ -0,0 +1,99 @@
+'''
+
+Checks of RankingEngine against ranking every query the way it used to be done: the distance
+of the query to each document in turn, sorted as (distance, doc id) pairs, the goldset items
+taking their 1-based position in that order. Some documents are duplicates of others,
+so that ties are broken by id, and ids are not in the order of the documents.
+
+usage: python -m pytest tests
+
+'''
+import numpy
+import pytest
+
+from src.common import util
+from src.models.ranking import RankingEngine
+
+MEASURES = {
+    'cosine': util.cosine_distance,
+    'hellinger': util.hellinger_distance,
+    'jensen_shannon': util.jensen_shannon_distance,
+}
+
+
+def make_data(seed=0, n_docs=40, n_queries=12, n_topics=8):
+    random = numpy.random.RandomState(seed)
+    docs = random.dirichlet(numpy.ones(n_topics), n_docs)
+    # every fourth document repeats the one before it, and a few repeat a query.
+    docs[3::4] = docs[2::4][:len(docs[3::4])]
+    queries = random.dirichlet(numpy.ones(n_topics), n_queries)
+    docs[[5, 17, 29]] = queries[0]
+    doc_ids = ['doc{:03d}'.format(idx) for idx in random.permutation(n_docs)]
+    query_ids = ['q{}'.format(idx) for idx in range(n_queries)]
+    goldsets = dict((qid, set(random.choice(doc_ids, 4, replace=False)))
+                    for qid in query_ids[:-1])
+    # the tied documents, and a query without any goldset.
+    goldsets[query_ids[0]] |= {doc_ids[5], doc_ids[17], doc_ids[29], doc_ids[3], doc_ids[2]}
+    return doc_ids, docs, query_ids, queries, goldsets
+
+
+def pairwise(doc_ids, docs, query, measure):
+    return sorted((MEASURES[measure](query, doc), doc_id) for doc_id, doc in zip(doc_ids, docs))
+
+
+def reference_rank(doc_ids, docs, query_ids, queries, goldsets, measure):
+    ranks = {}
+    for qid, query in zip(query_ids, queries):
+        if qid not in goldsets:
+            continue
+        ranks[qid] = [(idx + 1, distance, doc_id)
+                      for idx, (distance, doc_id) in enumerate(pairwise(doc_ids, docs, query, measure))
+                      if doc_id in goldsets[qid]]
+    return ranks
+
+
+def assert_same_ranks(ranks, expected):
+    assert sorted(ranks) == sorted(expected)
+    for qid, rels in expected.items():
+        assert [(rank, doc_id) for rank, _, doc_id in ranks[qid]] == [(rank, doc_id) for rank, _, doc_id in rels]
+        numpy.testing.assert_allclose([distance for _, distance, _ in ranks[qid]],
+                                      [distance for _, distance, _ in rels], atol=1e-7)
+
+
+@pytest.mark.parametrize('measure', sorted(MEASURES))
+@pytest.mark.parametrize('chunksize', [1, 5, 256])
+def test_rank(measure, chunksize):
+    doc_ids, docs, query_ids, queries, goldsets = make_data()
+    engine = RankingEngine(doc_ids, docs, measure=measure, chunksize=chunksize)
+    expected = reference_rank(doc_ids, docs, query_ids, queries, goldsets, measure)
+    assert_same_ranks(engine.rank(query_ids, queries, goldsets), expected)
+
+
+@pytest.mark.parametrize('measure', sorted(MEASURES))
+def test_rank_block(measure):
+    doc_ids, docs, query_ids, queries, goldsets = make_data(seed=1)
+    engine = RankingEngine(doc_ids, docs, measure=measure)
+    block = numpy.array([[MEASURES[measure](query, doc) for doc in docs] for query in queries])
+    expected = reference_rank(doc_ids, docs, query_ids, queries, goldsets, measure)
+    assert_same_ranks(engine.rank_block(query_ids, block, goldsets), expected)
+
+
+@pytest.mark.parametrize('measure', sorted(MEASURES))
+@pytest.mark.parametrize('k', [1, 3, 10, 100])
+def test_top_k(measure, k):
+    doc_ids, docs, _, queries, _ = make_data(seed=2)
+    engine = RankingEngine(doc_ids, docs, measure=measure)
+    for top, query in zip(engine.top_k(queries, k), queries):
+        expected = pairwise(doc_ids, docs, query, measure)[:k]
+        assert [doc_id for _, doc_id in top] == [doc_id for _, doc_id in expected]
+        numpy.testing.assert_allclose([distance for distance, _ in top],
+                                      [distance for distance, _ in expected], atol=1e-7)
+
+
+def test_ties_break_by_id():
+    doc_ids = ['c', 'a', 'd', 'b']
+    docs = numpy.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 0.0]])
+    engine = RankingEngine(doc_ids, docs)
+    ranks = engine.rank(['q'], [[1.0, 0.0]], {'q': {'b', 'c', 'd'}})
+    assert [(rank, doc_id) for rank, _, doc_id in ranks['q']] == [(2, 'b'), (3, 'c'), (4, 'd')]
+    assert [doc_id for _, doc_id in engine.top_k([[1.0, 0.0]], 2)[0]] == ['a', 'b']